@@ -9,6 +9,7 @@ import math
 import re
 import os
 import threading
+import time
 import logging
 from pathlib import Path
 from typing import Any
@@ -16,13 +17,18 @@ from urllib.parse import urlparse
 
 try:
     import psycopg2
-    from psycopg2.extras import RealDictCursor, execute_batch as PgExecuteBatch
+    from psycopg2.extras import (
+        RealDictCursor,
+        execute_batch as PgExecuteBatch,
+        execute_values as PgExecuteValues,
+    )
     from psycopg2 import IntegrityError as PgIntegrityError
     from psycopg2.pool import ThreadedConnectionPool
 except Exception:
     psycopg2 = None
     RealDictCursor = None
     PgExecuteBatch = None
+    PgExecuteValues = None
     PgIntegrityError = None
     ThreadedConnectionPool = None
 
@@ -43,6 +49,7 @@ if psycopg2 is None:
         psycopg2 = _Psycopg3Compat()
         RealDictCursor = None  # psycopg3'te dict_row zaten row_factory olarak set ediliyor
         PgExecuteBatch = None
+        PgExecuteValues = None
         PgIntegrityError = _psycopg3_errors.IntegrityError
     except Exception:
         pass
@@ -144,6 +151,31 @@ def _get_or_create_pg_pool():
     return _pg_pool
 
 
+def get_pool_health() -> dict[str, Any]:
+    """Bağlantı havuzunun anlık durumunu döndürür (/api/pool-health için).
+
+    Havuz kapalıysa ya da henüz oluşturulmamışsa da anlamlı bir özet verir;
+    _used/_pool sayaçları psycopg2 ThreadedConnectionPool iç alanlarıdır ve
+    yalnızca teşhis amaçlı okunur.
+    """
+    health: dict[str, Any] = {
+        "pool_enabled": bool(PG_POOL_ENABLED and ThreadedConnectionPool is not None),
+        "pool_created": _pg_pool is not None,
+        "min_conn": PG_POOL_MIN_CONN,
+        "max_conn": PG_POOL_MAX_CONN,
+        "in_use": None,
+        "idle": None,
+    }
+    pool = _pg_pool
+    if pool is not None:
+        try:
+            health["in_use"] = len(getattr(pool, "_used", {}) or {})
+            health["idle"] = len(getattr(pool, "_pool", []) or [])
+        except Exception:
+            pass
+    return health
+
+
 def close_pg_pool():
     """İhtiyaç halinde tüm pooled bağlantıları kapatır."""
     global _pg_pool
@@ -360,6 +392,28 @@ class PGCompatCursor:
             self._inner.executemany(query, adapted_params)
         return self
 
+    def execute_values(self, sql: str, seq_of_params, template: str | None = None):
+        """
+        'VALUES %s' kalıbındaki toplu INSERT'i psycopg2 execute_values ile tek
+        çok satırlı statement olarak çalıştırır; execute_values yoksa satır
+        şablonu yerine konarak executemany'e düşülür.
+        """
+        adapted_params = [adapt_params(p) for p in (seq_of_params or [])]
+        if not adapted_params:
+            return self
+        if IS_POSTGRES and PgExecuteValues is not None:
+            PgExecuteValues(
+                self._inner,
+                sql,
+                adapted_params,
+                template=template,
+                page_size=PG_EXECUTEMANY_PAGE_SIZE,
+            )
+            return self
+        row_sql = template or "(" + ", ".join(["%s"] * len(adapted_params[0])) + ")"
+        self._inner.executemany(sql.replace("%s", row_sql, 1), adapted_params)
+        return self
+
     def fetchone(self):
         return self._inner.fetchone()
 
@@ -394,6 +448,11 @@ class PGCompatConnection:
         cur.executemany(sql, seq_of_params)
         return cur
 
+    def execute_values(self, sql: str, seq_of_params, template: str | None = None):
+        cur = self.cursor()
+        cur.execute_values(sql, seq_of_params, template=template)
+        return cur
+
     def commit(self):
         return self._inner.commit()
 
@@ -687,6 +746,37 @@ def ensure_approval_requests_columns(cursor, ref_id_type: str):
         cursor.execute(f"ALTER TABLE approval_requests ADD COLUMN IF NOT EXISTS {col_name} {col_type}")
 
 
+# list_products serbest metin aramasının taradığı kolonların birleşik ifadesi.
+# Trigram index bu ifade üzerinde kurulur; sorgu tarafı da aynı ifadeyi
+# kullanmalı ki planlayıcı index'i seçebilsin.
+PRODUCT_SEARCH_EXPR = (
+    "COALESCE(child_name, '') || ' ' || COALESCE(child_sku, '') || ' ' || COALESCE(child_code, '')"
+)
+
+
+def ensure_search_trgm_index(conn):
+    """Serbest metin araması için pg_trgm GIN index'ini kurar.
+
+    Başında joker olan LIKE desenleri B-tree index kullanamaz; pg_trgm
+    trigram index'i bu aramaları sıralı taramadan index taramasına çevirir.
+    Uzantı yüklenemezse (örn. yetkisiz veritabanı rolü) arama mevcut LIKE
+    taramasıyla çalışmaya devam eder.
+    """
+    statements = [
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+        "CREATE INDEX IF NOT EXISTS idx_products_search_trgm "
+        f"ON products USING GIN (({PRODUCT_SEARCH_EXPR}) gin_trgm_ops)",
+    ]
+    for sql in statements:
+        try:
+            conn.execute(sql)
+            conn.commit()
+        except Exception as exc:
+            conn.rollback()
+            logger.warning("pg_trgm arama index'i kurulamadı: %s", exc)
+            return
+
+
 def ensure_indexes(cursor):
     """Sık erişilen sorgular için index'leri oluşturur."""
     index_sql = [
@@ -699,6 +789,7 @@ def ensure_indexes(cursor):
         "CREATE INDEX IF NOT EXISTS idx_products_parent_active ON products(parent_name, is_active)",
         "CREATE INDEX IF NOT EXISTS idx_products_active_parent_sku ON products(is_active, parent_name, child_sku)",
         "CREATE INDEX IF NOT EXISTS idx_products_active_kategori_parent ON products(is_active, kategori, parent_name)",
+        "CREATE INDEX IF NOT EXISTS idx_products_active_parent_kat ON products(is_active, parent_name, kategori)",
         "CREATE INDEX IF NOT EXISTS idx_products_active_kategori_identifier_sku ON products(is_active, kategori, product_identifier, child_sku)",
         "CREATE INDEX IF NOT EXISTS idx_products_identifier ON products(product_identifier)",
         "CREATE INDEX IF NOT EXISTS idx_products_variation_size ON products(variation_size)",
@@ -711,7 +802,19 @@ def ensure_indexes(cursor):
         "CREATE INDEX IF NOT EXISTS idx_cost_definitions_name ON cost_definitions(name)",
         "CREATE INDEX IF NOT EXISTS idx_cost_definitions_kargo_code ON cost_definitions(kargo_code)",
         "CREATE INDEX IF NOT EXISTS idx_product_costs_sku_assigned ON product_costs(child_sku, assigned)",
+        # Öneri/prefill sorguları yalnızca assigned = 1 satırlarını okur; partial
+        # index hem küçük kalır hem planner'ın index seek seçmesini sağlar.
+        "CREATE INDEX IF NOT EXISTS idx_product_costs_assigned_sku_partial "
+        "ON product_costs(child_sku, assigned) WHERE assigned = 1",
+        "CREATE INDEX IF NOT EXISTS idx_cost_definitions_cat_active_name "
+        "ON cost_definitions(category, is_active, name)",
         "CREATE INDEX IF NOT EXISTS idx_product_costs_assigned_cost ON product_costs(assigned, cost_name)",
+        # Export join'leri için covering index'ler: sorgular index-only scan ile
+        # döner, heap'ten satır çekilmez.
+        "CREATE INDEX IF NOT EXISTS idx_product_materials_sku_mat_qty "
+        "ON product_materials(child_sku, material_id, quantity)",
+        "CREATE INDEX IF NOT EXISTS idx_product_costs_sku_assigned_name "
+        "ON product_costs(child_sku, assigned, cost_name)",
         "CREATE INDEX IF NOT EXISTS idx_parent_cost_profiles_parent_id ON parent_cost_profiles(parent_id)",
         "CREATE INDEX IF NOT EXISTS idx_product_cost_breakdowns_parent_id ON product_cost_breakdowns(parent_id)",
         "CREATE INDEX IF NOT EXISTS idx_product_cost_breakdowns_child_sku ON product_cost_breakdowns(child_sku)",
@@ -730,6 +833,14 @@ def ensure_indexes(cursor):
     for sql in index_sql:
         cursor.execute(sql)
 
+    # İstatistikleri tazele ki planner yeni indexleri kullanmayı seçebilsin
+    # (ANALYZE, VACUUM'un aksine transaction içinde çalışabilir).
+    for table in ("products", "product_costs", "cost_definitions"):
+        try:
+            cursor.execute(f"ANALYZE {table}")
+        except Exception as e:
+            logger.warning(f"ANALYZE {table} başarısız: {e}")
+
 
 def init_db():
     """Veritabanını oluşturur ve tabloları hazırlar."""
@@ -935,6 +1046,10 @@ def init_db():
     backfill_product_raw_cost_status(cursor)
 
     conn.commit()
+
+    # Trigram index'i kendi commit/rollback'iyle kurulur; uzantı yetkisi
+    # olmayan ortamlarda init_db'yi düşürmemeli.
+    ensure_search_trgm_index(conn)
     conn.close()
 
 
@@ -1251,6 +1366,8 @@ def sync_cost_definitions_from_template():
 
     conn.commit()
     conn.close()
+    if inserted:
+        invalidate_cost_definitions_cache()
     return inserted
 
 
@@ -1371,6 +1488,8 @@ def normalize_legacy_gold_silver_names() -> int:
 
     conn.commit()
     conn.close()
+    if changed:
+        invalidate_cost_definitions_cache()
     return changed
 
 
@@ -1415,11 +1534,42 @@ def deactivate_shadowed_kaplama_base_names() -> int:
 
     conn.commit()
     conn.close()
+    if deactivate_ids:
+        invalidate_cost_definitions_cache()
     return len(deactivate_ids)
 
 
+# cost_definitions nadiren değişir ama öneri/prefill uçları her istekte okur;
+# kısa TTL + yazma anında invalidation ile cache'lenir.
+COST_DEFINITIONS_CACHE_TTL_SECONDS = max(0, int(os.getenv("COST_DEFINITIONS_CACHE_TTL_SECONDS", "60")))
+_cost_definitions_cache: dict[tuple, tuple[float, list]] = {}
+_cost_definitions_cache_lock = threading.Lock()
+# Tanım verisine bağlı türetilmiş cache'ler (token indeksi vb.) bu sayaçla tazelenir.
+_cost_definitions_version = 0
+
+
+def invalidate_cost_definitions_cache():
+    """cost_definitions tablosuna yazan her akış sonrası çağrılır."""
+    global _cost_definitions_version
+    with _cost_definitions_cache_lock:
+        _cost_definitions_cache.clear()
+        _cost_definitions_version += 1
+
+
+def get_cost_definitions_version() -> int:
+    return _cost_definitions_version
+
+
 def list_cost_definitions(active_only: bool = True, category: str | None = None):
     """Maliyet tanımlarını döndürür."""
+    cache_key = (bool(active_only), (category or "").strip().lower() or None)
+    if COST_DEFINITIONS_CACHE_TTL_SECONDS > 0:
+        now = time.time()
+        with _cost_definitions_cache_lock:
+            cached = _cost_definitions_cache.get(cache_key)
+            if cached and cached[0] > now:
+                return list(cached[1])
+
     conn = get_db()
 
     where = []
@@ -1454,6 +1604,14 @@ def list_cost_definitions(active_only: bool = True, category: str | None = None)
 
     result = [dict(r) for r in rows]
     conn.close()
+
+    if COST_DEFINITIONS_CACHE_TTL_SECONDS > 0:
+        with _cost_definitions_cache_lock:
+            _cost_definitions_cache[cache_key] = (
+                time.time() + COST_DEFINITIONS_CACHE_TTL_SECONDS,
+                result,
+            )
+        return list(result)
     return result
 
 
@@ -204,15 +204,19 @@ def get_template_structure():
     return structure
 
 
-def export_to_template(products: list[dict], output_path: str = None) -> str:
+def export_to_template(products, output_path: str = None) -> str:
     """
     Ürünleri maliyet_sablonu formatında Excel'e yazar.
-    
-    products: Her biri şu anahtarları taşıyabilir:
+
+    products: dict iterable'ı (liste ya da generator). Her öğe şu anahtarları
+    taşıyabilir:
         - child_sku, child_name, en, boy, alan_m2
         - materials: {material_name: quantity}
         - costs: {cost_name: 'x'}
-    
+
+    Workbook write_only modda açılır: satırlar append edildikçe diske akar,
+    tüm sayfa bellekte tutulmaz.
+
     Returns: Oluşturulan dosya yolu
     """
     if output_path is None:
@@ -229,18 +233,13 @@ def export_to_template(products: list[dict], output_path: str = None) -> str:
     template_wb = openpyxl.load_workbook(template_path, read_only=True)
     template_ws = template_wb["Maliyet Şablonu"]
 
-    # Yeni workbook oluştur
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = "Maliyet Şablonu"
+    # Yeni workbook oluştur (write_only'de aktif sayfa olmaz, sheet yaratılır)
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet("Maliyet Şablonu")
 
-    # Header satırını kopyala
-    headers = {}
-    for col in range(1, template_ws.max_column + 1):
-        val = template_ws.cell(row=1, column=col).value
-        if val:
-            ws.cell(row=1, column=col, value=val)
-            headers[str(val)] = col
+    ncols = template_ws.max_column
+    header_row = [template_ws.cell(row=1, column=col).value for col in range(1, ncols + 1)]
+    ws.append(header_row)
 
     template_wb.close()
 
@@ -325,30 +324,25 @@ def export_to_template(products: list[dict], output_path: str = None) -> str:
             return other[0]["col"]
         return candidates[0]["col"]
 
-    # Ürünleri yaz
-    for row_idx, product in enumerate(products, start=2):
+    info_cells = [
+        ("Ürün Kodu", "child_sku"),
+        ("Ürün Adı", "child_name"),
+        ("En", "en"),
+        ("Boy", "boy"),
+        ("Yükseklik", "yukseklik"),
+        ("Ağırlık", "agirlik"),
+        ("Desi", "desi"),
+    ]
+
+    # Ürünleri yaz: her ürün tek satır listesi olarak kurulup append edilir
+    for product in products:
+        row_values: list = [None] * ncols
+
         # Temel bilgiler
-        if info_map["Ürün Kodu"]:
-            ws.cell(row=row_idx, column=info_map["Ürün Kodu"],
-                    value=product.get("child_sku"))
-        if info_map["Ürün Adı"]:
-            ws.cell(row=row_idx, column=info_map["Ürün Adı"],
-                    value=product.get("child_name"))
-        if info_map["En"]:
-            ws.cell(row=row_idx, column=info_map["En"],
-                    value=product.get("en"))
-        if info_map["Boy"]:
-            ws.cell(row=row_idx, column=info_map["Boy"],
-                    value=product.get("boy"))
-        if info_map["Yükseklik"]:
-            ws.cell(row=row_idx, column=info_map["Yükseklik"],
-                    value=product.get("yukseklik"))
-        if info_map["Ağırlık"]:
-            ws.cell(row=row_idx, column=info_map["Ağırlık"],
-                    value=product.get("agirlik"))
-        if info_map["Desi"]:
-            ws.cell(row=row_idx, column=info_map["Desi"],
-                    value=product.get("desi"))
+        for header, key in info_cells:
+            col = info_map[header]
+            if col:
+                row_values[col - 1] = product.get(key)
 
         # Hammaddeler
         materials = product.get("materials", {})
@@ -357,14 +351,16 @@ def export_to_template(products: list[dict], output_path: str = None) -> str:
                 continue
             mat_col = resolve_material_col(mat_name)
             if mat_col:
-                ws.cell(row=row_idx, column=mat_col, value=quantity)
+                row_values[mat_col - 1] = quantity
 
         # Maliyet (ambalaj) atamaları
         costs = product.get("costs", {})
         for cost_name, marker in costs.items():
             cost_col = resolve_cost_col(cost_name, product)
             if cost_col:
-                ws.cell(row=row_idx, column=cost_col, value=marker)
+                row_values[cost_col - 1] = marker
+
+        ws.append(row_values)
 
     wb.save(output_path)
     return output_path
@@ -9,9 +9,43 @@ from fastapi.responses import FileResponse
 from fastapi.responses import JSONResponse
 from starlette.background import BackgroundTask
 from typing import Optional
+
+# orjson varsa JSON serileştirme onunla yapılır (2-5x hızlı); yoksa stdlib json.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if orjson is not None:
+    from fastapi.responses import ORJSONResponse as _FastAPIORJSONResponse
+
+    class _DefaultResponseClass(_FastAPIORJSONResponse):
+        """OPT_NON_STR_KEYS ile int anahtarlı dict'ler de (örn. material_id
+        haritaları) ara jsonable_encoder turu olmadan serileştirilir."""
+
+        def render(self, content) -> bytes:
+            return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+else:
+    from fastapi.responses import JSONResponse as _DefaultResponseClass
+
+
+def json_dumps_compact(obj) -> str:
+    """Kompakt JSON metni üretir; orjson kuruluysa onu kullanır."""
+    if orjson is not None:
+        return orjson.dumps(obj).decode("utf-8")
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+
+def json_loads_text(text):
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
 import os
+import sys
 import csv
 import re
+import atexit
+import queue
 import time
 import json
 import math
@@ -24,8 +58,10 @@ import hashlib
 import secrets
 import logging
 import traceback
+import types
 from pathlib import Path
-from collections import defaultdict
+from collections import Counter, defaultdict
+from functools import lru_cache
 
 logger = logging.getLogger("maliyet")
 logging.basicConfig(level=logging.INFO)
@@ -33,11 +69,13 @@ logging.basicConfig(level=logging.INFO)
 from database import (
     get_db, init_db, load_mapped_products, load_default_materials, load_cost_names,
     sync_cost_definitions_from_template, list_cost_definitions,
+    invalidate_cost_definitions_cache, get_cost_definitions_version,
     canonicalize_kaplama_cost_name, normalize_legacy_gold_silver_names,
     deactivate_shadowed_kaplama_base_names, deactivate_cus_products,
     resolve_template_path,
     normalize_product_categories, get_supported_categories,
     DB_BACKEND, DATABASE_URL, DATABASE_IS_SUPABASE_DIRECT, get_database_diagnostics,
+    PRODUCT_SEARCH_EXPR, get_pool_health,
     IntegrityError as DBIntegrityError,
 )
 from models import (
@@ -59,6 +97,7 @@ app = FastAPI(
     title="Maliyet Sistemi API",
     description="ERP Maliyet Şablonu Yönetim Sistemi",
     version="1.0.0",
+    default_response_class=_DefaultResponseClass,
 )
 
 REQUEST_AUDIT_CONTEXT: contextvars.ContextVar[dict] = contextvars.ContextVar(
@@ -144,6 +183,11 @@ KAPLAMA_GOLD_COPPER_TOKENS = {
 AUTH_SECRET = os.getenv("AUTH_SECRET", "maliyet-dev-secret-change-me")
 AUTH_TOKEN_TTL_SECONDS = int(os.getenv("AUTH_TOKEN_TTL_SECONDS", "43200"))  # 12 saat
 AUTH_HASH_ITERATIONS = int(os.getenv("AUTH_HASH_ITERATIONS", "120000"))
+# scrypt parametreleri: bellek-sert olduğu için aynı güvenlik seviyesini
+# PBKDF2'den çok daha az CPU süresiyle sağlar (login threadpool'unu rahatlatır).
+AUTH_SCRYPT_N = int(os.getenv("AUTH_SCRYPT_N", "16384"))
+AUTH_SCRYPT_R = int(os.getenv("AUTH_SCRYPT_R", "8"))
+AUTH_SCRYPT_P = int(os.getenv("AUTH_SCRYPT_P", "1"))
 EXPOSE_HEALTH_DETAILS = env_flag("EXPOSE_HEALTH_DETAILS", default=not IS_PRODUCTION)
 DISABLE_AUTH = env_flag("DISABLE_AUTH", default=True)
 AUTH_BYPASS_USERNAME = (os.getenv("AUTH_BYPASS_USERNAME", "acik-erisim").strip() or "acik-erisim")
@@ -186,6 +230,12 @@ ADMIN_ONLY_RULES: list[tuple[str, str]] = [
 ]
 
 
+# Ürün/hammadde/maliyet verisini değiştiren her yazmada artan sürüm sayacı.
+# Cache anahtarına girdiği için eski sürümle yazılmış kayıtlar TTL dolmadan
+# da doğal olarak ıskalanır; uzun TTL stale okuma riski olmadan kullanılabilir.
+_product_data_version = 0
+
+
 def build_product_groups_cache_key(
     kategori: Optional[str],
     search: Optional[str],
@@ -194,6 +244,7 @@ def build_product_groups_cache_key(
 ) -> str:
     return json.dumps(
         {
+            "version": _product_data_version,
             "kategori": (kategori or "").strip().lower(),
             "search": (search or "").strip().lower(),
             "page": int(page),
@@ -237,7 +288,9 @@ def set_product_groups_cache(cache_key: str, payload: dict):
 
 
 def invalidate_product_groups_cache():
+    global _product_data_version
     with _product_groups_cache_lock:
+        _product_data_version += 1
         _product_groups_cache.clear()
     with _stats_cache_lock:
         _stats_cache["data"] = None
@@ -292,14 +345,39 @@ def normalize_kargo_code(value: str | None) -> str | None:
     return f"{m.group(1)}-{m.group(2)}"
 
 
-def tokenize_text(value: str | None) -> set[str]:
+_EMPTY_TOKEN_SET: frozenset[str] = frozenset()
+
+
+@lru_cache(maxsize=8192)
+def _tokenize_text_cached(value: str) -> frozenset[str]:
+    tokens = TOKEN_PATTERN.findall(value.lower())
+    return frozenset(t for t in tokens if len(t) > 1 and t not in KAPLAMA_STOP_TOKENS)
+
+
+def tokenize_text(value: str | None) -> frozenset[str]:
+    # Aynı renk/boyut/isim dizgeleri öneri döngülerinde binlerce kez gelir;
+    # sonuç frozenset olduğu için cache'lenmiş değer güvenle paylaşılır.
     if not value:
-        return set()
-    raw = str(value).lower()
-    tokens = TOKEN_PATTERN.findall(raw)
-    return {t for t in tokens if len(t) > 1 and t not in KAPLAMA_STOP_TOKENS}
+        return _EMPTY_TOKEN_SET
+    return _tokenize_text_cached(str(value))
+
+
+def _token_mask(tokens, token_id: dict[str, int]) -> int:
+    """
+    Token kümesini bit maskesine paketler; token_id sözlüğü görüldükçe büyür.
+    Kesişim boyutu böylece set işlemi yerine (a & b).bit_count() ile alınır.
+    """
+    mask = 0
+    for tok in tokens:
+        bit = token_id.get(tok)
+        if bit is None:
+            bit = len(token_id)
+            token_id[tok] = bit
+        mask |= 1 << bit
+    return mask
 
 
+@lru_cache(maxsize=8192)
 def detect_kaplama_tier(*values: str | None) -> str:
     tokens: set[str] = set()
     for value in values:
@@ -311,6 +389,30 @@ def detect_kaplama_tier(*values: str | None) -> str:
     return "other"
 
 
+@lru_cache(maxsize=4096)
+def _kaplama_signature(name: str | None, color: str | None) -> tuple[str, str, frozenset[str]]:
+    """Aynı (isim, renk) çifti için tier + grup anahtarı + token kümesini tek geçişte üretir."""
+    tier = detect_kaplama_tier(name, color)
+    return tier, build_kaplama_group_key(name, tier), tokenize_text(name) | tokenize_text(color)
+
+
+@lru_cache(maxsize=8)
+def _kaplama_token_index(version: int) -> tuple[tuple[str, ...], dict, dict]:
+    """
+    Aktif kaplama tanımlarının token ve tier indeksi. Tanımlar nadiren
+    değiştiğinden istek başına yeniden kurmak yerine cost_definitions
+    versiyon sayacı üzerinden cache'lenir.
+    """
+    names = tuple(
+        d["name"]
+        for d in list_cost_definitions(active_only=True, category="kaplama")
+        if d.get("name")
+    )
+    tokens = {name: tokenize_text(name) for name in names}
+    tiers = {name: detect_kaplama_tier(name) for name in names}
+    return names, tokens, tiers
+
+
 def build_kaplama_group_key(name: str | None, tier: str | None) -> str:
     normalized_name = (name or "").strip()
     normalized_tier = (tier or "other").strip().lower() or "other"
@@ -532,27 +634,54 @@ def _b64url_decode(raw: str) -> bytes:
 def hash_password(password: str, salt: str | None = None) -> str:
     password_raw = str(password or "").encode("utf-8")
     salt_raw = (salt or secrets.token_hex(16)).encode("utf-8")
-    digest = hashlib.pbkdf2_hmac("sha256", password_raw, salt_raw, AUTH_HASH_ITERATIONS)
-    return f"pbkdf2_sha256${AUTH_HASH_ITERATIONS}${salt_raw.decode('utf-8')}${digest.hex()}"
+    digest = hashlib.scrypt(
+        password_raw,
+        salt=salt_raw,
+        n=AUTH_SCRYPT_N,
+        r=AUTH_SCRYPT_R,
+        p=AUTH_SCRYPT_P,
+        maxmem=64 * 1024 * 1024,
+        dklen=32,
+    )
+    return f"scrypt${AUTH_SCRYPT_N}${AUTH_SCRYPT_R}${AUTH_SCRYPT_P}${salt_raw.decode('utf-8')}${digest.hex()}"
 
 
 def verify_password(password: str, password_hash: str) -> bool:
+    password_raw = str(password or "").encode("utf-8")
     try:
-        algo, iter_text, salt, digest_hex = str(password_hash).split("$", 3)
-        if algo != "pbkdf2_sha256":
-            return False
-        iterations = int(iter_text)
-        digest = hashlib.pbkdf2_hmac(
-            "sha256",
-            str(password or "").encode("utf-8"),
-            salt.encode("utf-8"),
-            iterations,
-        )
-        return hmac.compare_digest(digest.hex(), digest_hex)
+        parts = str(password_hash).split("$")
+        algo = parts[0]
+        if algo == "scrypt":
+            _, n_text, r_text, p_text, salt, digest_hex = parts
+            digest = hashlib.scrypt(
+                password_raw,
+                salt=salt.encode("utf-8"),
+                n=int(n_text),
+                r=int(r_text),
+                p=int(p_text),
+                maxmem=64 * 1024 * 1024,
+                dklen=32,
+            )
+            return hmac.compare_digest(digest.hex(), digest_hex)
+        if algo == "pbkdf2_sha256":
+            # Geçiş öncesi üretilmiş hash'ler; başarılı login'de scrypt'e taşınır.
+            _, iter_text, salt, digest_hex = parts
+            digest = hashlib.pbkdf2_hmac(
+                "sha256",
+                password_raw,
+                salt.encode("utf-8"),
+                int(iter_text),
+            )
+            return hmac.compare_digest(digest.hex(), digest_hex)
+        return False
     except Exception:
         return False
 
 
+def password_needs_rehash(password_hash: str) -> bool:
+    return not str(password_hash or "").startswith("scrypt$")
+
+
 def generate_auth_token(user_id: int, username: str, role: str) -> str:
     payload = {
         "uid": int(user_id),
@@ -561,7 +690,7 @@ def generate_auth_token(user_id: int, username: str, role: str) -> str:
         "iat": int(time.time()),
         "exp": int(time.time()) + AUTH_TOKEN_TTL_SECONDS,
     }
-    payload_text = json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+    payload_text = json_dumps_compact(payload)
     payload_b64 = _b64url_encode(payload_text.encode("utf-8"))
     signature = hmac.new(AUTH_SECRET.encode("utf-8"), payload_b64.encode("utf-8"), hashlib.sha256).digest()
     return f"{payload_b64}.{_b64url_encode(signature)}"
@@ -669,6 +798,79 @@ def get_user_by_id(user_id: int):
         conn.close()
 
 
+# Audit kayıtları istek yanıtını bekletmesin diye arka plan kuyruğuna yazılır
+# ve tek bir thread tarafından toplu INSERT'lerle boşaltılır. Vercel'de yanıt
+# sonrası süreç dondurulabildiği için orada senkron yazım varsayılandır.
+AUDIT_LOG_ASYNC = env_flag("AUDIT_LOG_ASYNC", default=not IS_VERCEL)
+AUDIT_FLUSH_BATCH_SIZE = max(1, int(os.getenv("AUDIT_FLUSH_BATCH_SIZE", "100")))
+AUDIT_FLUSH_INTERVAL_SECONDS = max(0.0, float(os.getenv("AUDIT_FLUSH_INTERVAL_MS", "50")) / 1000.0)
+
+_AUDIT_INSERT_SQL = """
+    INSERT INTO audit_logs (
+        user_id, username, action, target, details,
+        request_id, method, path, ip_address, user_agent, status
+    )
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+_audit_queue: queue.Queue = queue.Queue(maxsize=10000)
+_audit_thread_started = False
+_audit_thread_lock = threading.Lock()
+
+
+def _audit_flush(batch: list[tuple]):
+    if not batch:
+        return
+    try:
+        conn = get_db()
+        conn.executemany(_AUDIT_INSERT_SQL, batch)
+        conn.commit()
+        conn.close()
+    except Exception:
+        # Audit hiçbir zaman ana akışı düşürmesin.
+        pass
+
+
+def _audit_drain():
+    while True:
+        try:
+            batch = [_audit_queue.get()]
+            deadline = time.monotonic() + AUDIT_FLUSH_INTERVAL_SECONDS
+            while len(batch) < AUDIT_FLUSH_BATCH_SIZE:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(_audit_queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            _audit_flush(batch)
+        except Exception:
+            pass
+
+
+def _ensure_audit_thread():
+    global _audit_thread_started
+    if _audit_thread_started:
+        return
+    with _audit_thread_lock:
+        if _audit_thread_started:
+            return
+        threading.Thread(target=_audit_drain, name="audit-drain", daemon=True).start()
+        _audit_thread_started = True
+
+
+@atexit.register
+def _audit_flush_on_exit():
+    pending: list[tuple] = []
+    while True:
+        try:
+            pending.append(_audit_queue.get_nowait())
+        except queue.Empty:
+            break
+    _audit_flush(pending)
+
+
 def write_audit_log(
     user: dict | None,
     action: str,
@@ -678,31 +880,27 @@ def write_audit_log(
 ):
     try:
         ctx = REQUEST_AUDIT_CONTEXT.get({})
-        conn = get_db()
-        conn.execute(
-            """
-            INSERT INTO audit_logs (
-                user_id, username, action, target, details,
-                request_id, method, path, ip_address, user_agent, status
-            )
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """,
-            (
-                user.get("id") if user else None,
-                user.get("username") if user else None,
-                action,
-                target,
-                json.dumps(details or {}, ensure_ascii=False),
-                ctx.get("request_id"),
-                ctx.get("method"),
-                ctx.get("path"),
-                ctx.get("ip_address"),
-                ctx.get("user_agent"),
-                str(status or "ok"),
-            ),
+        row = (
+            user.get("id") if user else None,
+            user.get("username") if user else None,
+            action,
+            target,
+            json_dumps_compact(details or {}),
+            ctx.get("request_id"),
+            ctx.get("method"),
+            ctx.get("path"),
+            ctx.get("ip_address"),
+            ctx.get("user_agent"),
+            str(status or "ok"),
         )
-        conn.commit()
-        conn.close()
+        if AUDIT_LOG_ASYNC:
+            _ensure_audit_thread()
+            try:
+                _audit_queue.put_nowait(row)
+                return
+            except queue.Full:
+                pass  # Kuyruk doluysa senkron yola düş.
+        _audit_flush([row])
     except Exception:
         # Audit hiçbir zaman ana akışı düşürmesin.
         pass
@@ -800,7 +998,7 @@ def create_approval_request(request_type: str, target: str | None, payload: dict
             (
                 str(request_type or "").strip(),
                 target,
-                json.dumps(payload or {}, ensure_ascii=False),
+                json_dumps_compact(payload or {}),
                 user.get("id") if user else None,
                 user.get("username") if user else None,
             ),
@@ -815,7 +1013,7 @@ def create_approval_request(request_type: str, target: str | None, payload: dict
             (
                 str(request_type or "").strip(),
                 target,
-                json.dumps(payload or {}, ensure_ascii=False),
+                json_dumps_compact(payload or {}),
                 user.get("id") if user else None,
                 user.get("username") if user else None,
             ),
@@ -832,16 +1030,18 @@ def parse_json_text(value):
     if isinstance(value, (dict, list)):
         return value
     try:
-        return json.loads(str(value))
+        return json_loads_text(str(value))
     except Exception:
         return value
 
 
-def chunk_list(items: list, chunk_size: int) -> list[list]:
-    """Listeyi sabit boyutlu parçalara böler."""
-    if chunk_size <= 0:
-        return [items]
-    return [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+def iter_rows(cursor, batch_size: int = 512):
+    """Satırları fetchmany partileriyle akıtır; fetchall gibi tüm sonucu belleğe almaz."""
+    while True:
+        batch = cursor.fetchmany(batch_size)
+        if not batch:
+            return
+        yield from batch
 
 
 def safe_unlink(path: str):
@@ -853,10 +1053,10 @@ def safe_unlink(path: str):
 
 
 def format_approval_row(row):
-    item = dict(row)
-    item["payload"] = parse_json_text(item.get("payload"))
-    item["execution_result"] = parse_json_text(item.get("execution_result"))
-    return item
+    # Satırlar sürücüden zaten dict (RealDictRow) gelir; kopyalamadan yerinde işlenir.
+    row["payload"] = parse_json_text(row.get("payload"))
+    row["execution_result"] = parse_json_text(row.get("execution_result"))
+    return row
 
 
 def merge_product_cost_name(conn, old_name: str, new_name: str):
@@ -913,8 +1113,31 @@ def parse_kargo_dims(value) -> tuple[float | None, float | None, float | None]:
     return None, None, None
 
 
+# kargo.csv her istekte yeniden parse edilmesin diye kısa TTL ile cache'lenir;
+# dosya nadiren değişir, TTL dolunca kendiliğinden tazelenir.
+KARGO_CACHE_TTL_SECONDS = max(0, int(os.getenv("KARGO_CACHE_TTL_SECONDS", "300")))
+_kargo_rows_cache: dict = {"data": None, "expires_at": 0.0}
+_kargo_rows_cache_lock = threading.Lock()
+
+
 def load_kargo_rows() -> list[dict]:
     """kargo.csv satırlarını normalize edip liste olarak döndürür."""
+    if KARGO_CACHE_TTL_SECONDS > 0:
+        now = time.time()
+        with _kargo_rows_cache_lock:
+            if _kargo_rows_cache["data"] is not None and _kargo_rows_cache["expires_at"] > now:
+                return _kargo_rows_cache["data"]
+
+    rows = _parse_kargo_rows()
+
+    if KARGO_CACHE_TTL_SECONDS > 0:
+        with _kargo_rows_cache_lock:
+            _kargo_rows_cache["data"] = rows
+            _kargo_rows_cache["expires_at"] = time.time() + KARGO_CACHE_TTL_SECONDS
+    return rows
+
+
+def _parse_kargo_rows() -> list[dict]:
     rows: list[dict] = []
     csv_path = resolve_kargo_csv_path()
     if not csv_path.exists():
@@ -943,16 +1166,17 @@ def load_kargo_rows() -> list[dict]:
     return rows
 
 
-def load_kargo_lookup() -> dict[str, dict]:
-    """kargo.csv dosyasını kod bazlı lookup tablosu olarak yükler."""
-    lookup: dict[str, dict] = {}
+def load_kargo_lookup() -> dict[str, tuple]:
+    """
+    kargo.csv dosyasını kod bazlı lookup tablosu olarak yükler.
+
+    Değerler (en, boy, yukseklik) tuple'larıdır: child döngüsünde kod başına
+    tek hash lookup + tuple-unpack yeterli olur, iç dict'e üç ayrı string-key
+    erişimi gerekmez.
+    """
+    lookup: dict[str, tuple] = {}
     for row in load_kargo_rows():
-        lookup[row["code"]] = {
-            "kargo_kodu": row["code"],
-            "kargo_en": row["en"],
-            "kargo_boy": row["boy"],
-            "kargo_yukseklik": row["yukseklik"],
-        }
+        lookup[row["code"]] = (row["en"], row["boy"], row["yukseklik"])
     return lookup
 
 
@@ -1161,23 +1385,31 @@ async def ensure_startup_middleware(request: Request, call_next):
     return await call_next(request)
 
 
+# Sağlık yanıtının süreç ömrü boyunca değişmeyen kısmı; liveness probe'ları
+# her istekte aynı sözlüğü yeniden kurmasın diye modül yüklenirken bir kez
+# hesaplanır.
+_STATIC_HEALTH = types.MappingProxyType({
+    "db_backend": DB_BACKEND,
+    "is_production": IS_PRODUCTION,
+    "app_env": APP_ENV,
+    "has_database_url": bool(DATABASE_URL),
+    "seed_default_users": SEED_DEFAULT_USERS,
+    "enable_product_sync": ENABLE_PRODUCT_SYNC,
+    "enable_approval_workflow": ENABLE_APPROVAL_WORKFLOW,
+    "auth_disabled": DISABLE_AUTH,
+    "supported_categories": tuple(get_supported_categories()),
+    "cors_origins": tuple(ALLOWED_CORS_ORIGINS),
+    **get_database_diagnostics(),
+})
+
+
 @app.get("/api/health")
 def health_check():
     """Sağlık kontrolü. Startup durumunu görmek için."""
     info = {
         "status": "ok" if _startup_done and not _startup_error else "error",
         "startup_done": _startup_done,
-        "db_backend": DB_BACKEND,
-        "is_production": IS_PRODUCTION,
-        "app_env": APP_ENV,
-        "has_database_url": bool(DATABASE_URL),
-        "seed_default_users": SEED_DEFAULT_USERS,
-        "enable_product_sync": ENABLE_PRODUCT_SYNC,
-        "enable_approval_workflow": ENABLE_APPROVAL_WORKFLOW,
-        "auth_disabled": DISABLE_AUTH,
-        "supported_categories": get_supported_categories(),
-        "cors_origins": ALLOWED_CORS_ORIGINS,
-        **get_database_diagnostics(),
+        **_STATIC_HEALTH,
     }
     if _startup_error and EXPOSE_HEALTH_DETAILS:
         info["startup_error"] = _startup_error
@@ -1194,6 +1426,13 @@ def health_check():
     return info
 
 
+@app.get("/api/pool-health")
+def pool_health(request: Request):
+    """Bağlantı havuzu teşhis bilgisi (yalnızca admin)."""
+    require_admin_user(request)
+    return get_pool_health()
+
+
 # ─────────────────────────── AUTH ───────────────────────────
 
 @app.post("/api/auth/login")
@@ -1228,6 +1467,20 @@ def login(data: AuthLoginRequest):
     if not verify_password(data.password, user_row["password_hash"]):
         raise HTTPException(status_code=401, detail="Kullanıcı adı veya parola hatalı")
 
+    if password_needs_rehash(user_row["password_hash"]):
+        # Eski PBKDF2 hash'i başarılı login'de sessizce scrypt'e taşınır.
+        try:
+            new_hash = hash_password(data.password)
+            conn = get_db()
+            conn.execute(
+                "UPDATE users SET password_hash = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
+                (new_hash, user_row["id"]),
+            )
+            conn.commit()
+            conn.close()
+        except Exception:
+            logger.warning("Parola hash'i scrypt'e taşınamadı: username=%s", username)
+
     user = serialize_user(user_row)
     token = generate_auth_token(user["id"], user["username"], user["role"])
     write_audit_log(user, "auth.login", target=user["username"])
@@ -1258,10 +1511,14 @@ def change_password(data: AuthChangePasswordRequest, request: Request):
     if not row or not verify_password(current_password, row["password_hash"]):
         raise HTTPException(status_code=400, detail="Mevcut parola hatalı")
 
+    # Hash CPU maliyetli; havuz bağlantısını hash boyunca tutmamak için
+    # bağlantı alınmadan önce hesaplanır.
+    new_password_hash = hash_password(new_password)
+
     conn = get_db()
     conn.execute(
         "UPDATE users SET password_hash = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?",
-        (hash_password(new_password), user["id"]),
+        (new_password_hash, user["id"]),
     )
     conn.commit()
     conn.close()
@@ -1282,7 +1539,8 @@ def list_users(request: Request):
         """
     ).fetchall()
     conn.close()
-    return [dict(r) for r in rows]
+    # Satırlar sürücüden zaten dict olarak gelir; kopyalamadan döndürülür.
+    return rows
 
 
 @app.post("/api/auth/users")
@@ -1295,79 +1553,78 @@ def create_user(data: AuthUserCreate, request: Request):
     if len(password) < 6:
         raise HTTPException(status_code=400, detail="Parola en az 6 karakter olmalı")
 
+    # Hash, bağlantı havuzunu meşgul etmemek için bağlantı alınmadan hesaplanır.
+    password_hash = hash_password(password)
+
     conn = get_db()
     try:
-        cur = conn.execute(
+        row = conn.execute(
             """
             INSERT INTO users (username, password_hash, role, is_active, updated_at)
             VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+            RETURNING id, username, role, is_active, created_at, updated_at
             """,
-            (username, hash_password(password), data.role, int(data.is_active)),
-        )
-        row = conn.execute(
-            "SELECT id, username, role, is_active, created_at, updated_at FROM users WHERE id = ?",
-            (cur.lastrowid,),
+            (username, password_hash, data.role, int(data.is_active)),
         ).fetchone()
         conn.commit()
     except DBIntegrityError:
-        conn.close()
         raise HTTPException(status_code=409, detail="Bu kullanıcı adı zaten kayıtlı")
-    conn.close()
+    finally:
+        conn.close()
 
     write_audit_log(admin, "auth.user_create", target=username, details={"role": data.role, "is_active": data.is_active})
-    return dict(row)
+    return row
 
 
 @app.put("/api/auth/users/{user_id}")
 def update_user(user_id: int, data: AuthUserUpdate, request: Request):
     admin = require_admin_user(request)
-    conn = get_db()
-    existing = conn.execute(
-        "SELECT id, username, role, is_active FROM users WHERE id = ?",
-        (user_id,),
-    ).fetchone()
-    if not existing:
-        conn.close()
-        raise HTTPException(status_code=404, detail="Kullanıcı bulunamadı")
-
-    new_role = data.role if data.role is not None else existing["role"]
-    new_is_active = int(data.is_active if data.is_active is not None else bool(existing["is_active"]))
+    # Hash, havuz bağlantısı hash süresince bloke olmasın diye önce hesaplanır.
     new_password_hash = hash_password(data.password) if data.password else None
 
-    # En az 1 aktif admin kalsın
-    if existing["role"] == "admin" and (new_role != "admin" or new_is_active == 0):
-        active_admin_count = row_first_value(conn.execute(
-            "SELECT COUNT(*) FROM users WHERE role = 'admin' AND is_active = 1"
-        ).fetchone()) or 0
-        if active_admin_count <= 1:
-            conn.close()
-            raise HTTPException(status_code=400, detail="Sistemde en az 1 aktif admin kalmalı")
+    conn = get_db()
+    try:
+        existing = conn.execute(
+            "SELECT id, username, role, is_active FROM users WHERE id = ?",
+            (user_id,),
+        ).fetchone()
+        if not existing:
+            raise HTTPException(status_code=404, detail="Kullanıcı bulunamadı")
 
-    if new_password_hash:
-        conn.execute(
-            """
-            UPDATE users
-            SET password_hash = ?, role = ?, is_active = ?, updated_at = CURRENT_TIMESTAMP
-            WHERE id = ?
-            """,
-            (new_password_hash, new_role, new_is_active, user_id),
-        )
-    else:
-        conn.execute(
-            """
-            UPDATE users
-            SET role = ?, is_active = ?, updated_at = CURRENT_TIMESTAMP
-            WHERE id = ?
-            """,
-            (new_role, new_is_active, user_id),
-        )
+        new_role = data.role if data.role is not None else existing["role"]
+        new_is_active = int(data.is_active if data.is_active is not None else bool(existing["is_active"]))
 
-    row = conn.execute(
-        "SELECT id, username, role, is_active, created_at, updated_at FROM users WHERE id = ?",
-        (user_id,),
-    ).fetchone()
-    conn.commit()
-    conn.close()
+        # En az 1 aktif admin kalsın
+        if existing["role"] == "admin" and (new_role != "admin" or new_is_active == 0):
+            active_admin_count = row_first_value(conn.execute(
+                "SELECT COUNT(*) FROM users WHERE role = 'admin' AND is_active = 1"
+            ).fetchone()) or 0
+            if active_admin_count <= 1:
+                raise HTTPException(status_code=400, detail="Sistemde en az 1 aktif admin kalmalı")
+
+        if new_password_hash:
+            row = conn.execute(
+                """
+                UPDATE users
+                SET password_hash = ?, role = ?, is_active = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+                RETURNING id, username, role, is_active, created_at, updated_at
+                """,
+                (new_password_hash, new_role, new_is_active, user_id),
+            ).fetchone()
+        else:
+            row = conn.execute(
+                """
+                UPDATE users
+                SET role = ?, is_active = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+                RETURNING id, username, role, is_active, created_at, updated_at
+                """,
+                (new_role, new_is_active, user_id),
+            ).fetchone()
+        conn.commit()
+    finally:
+        conn.close()
 
     write_audit_log(
         admin,
@@ -1375,7 +1632,7 @@ def update_user(user_id: int, data: AuthUserUpdate, request: Request):
         target=existing["username"],
         details={"role": new_role, "is_active": bool(new_is_active), "password_updated": bool(new_password_hash)},
     )
-    return dict(row)
+    return row
 
 
 @app.delete("/api/auth/users/{user_id}")
@@ -1425,17 +1682,15 @@ def list_audit_logs(request: Request, limit: int = Query(200, ge=1, le=1000)):
     ).fetchall()
     conn.close()
 
-    out = []
+    # Satırlar zaten dict; details alanı yerinde parse edilip aynı liste döndürülür.
     for row in rows:
-        item = dict(row)
-        raw_details = item.get("details")
+        raw_details = row.get("details")
         if raw_details:
             try:
-                item["details"] = json.loads(raw_details)
+                row["details"] = json_loads_text(raw_details)
             except Exception:
                 pass
-        out.append(item)
-    return out
+    return rows
 
 
 @app.get("/api/approvals")
@@ -1477,52 +1732,45 @@ def review_approval(
 ):
     admin = require_admin_user(request)
     conn = get_db()
-    row = conn.execute(
-        """
-        SELECT id, request_type, target, status, payload
-        FROM approval_requests
-        WHERE id = ?
-        """,
-        (approval_id,),
-    ).fetchone()
-    if not row:
-        conn.close()
-        raise HTTPException(status_code=404, detail="Onay kaydı bulunamadı")
-    if str(row["status"]).lower() != "pending":
-        conn.close()
-        raise HTTPException(status_code=409, detail="Bu kayıt bekleyen onay durumunda değil")
+    try:
+        row = conn.execute(
+            """
+            SELECT id, request_type, target, status, payload
+            FROM approval_requests
+            WHERE id = ?
+            """,
+            (approval_id,),
+        ).fetchone()
+        if not row:
+            raise HTTPException(status_code=404, detail="Onay kaydı bulunamadı")
+        if str(row["status"]).lower() != "pending":
+            raise HTTPException(status_code=409, detail="Bu kayıt bekleyen onay durumunda değil")
 
-    new_status = "approved" if bool(data.approve) else "rejected"
-    conn.execute(
-        """
-        UPDATE approval_requests
-        SET status = ?,
-            reviewed_by = ?,
-            reviewed_username = ?,
-            review_note = ?,
-            reviewed_at = CURRENT_TIMESTAMP
-        WHERE id = ?
-        """,
-        (
-            new_status,
-            admin["id"],
-            admin["username"],
-            (data.review_note or "").strip() or None,
-            approval_id,
-        ),
-    )
-    conn.commit()
-    updated = conn.execute(
-        """
-        SELECT id, request_type, target, payload, status,
-               requested_by, requested_username, reviewed_by, reviewed_username,
-               review_note, execution_result, created_at, reviewed_at, executed_at
-        FROM approval_requests
-        WHERE id = ?
-        """,
-        (approval_id,),
-    ).fetchone()
-    conn.close()
+        new_status = "approved" if bool(data.approve) else "rejected"
+        updated = conn.execute(
+            """
+            UPDATE approval_requests
+            SET status = ?,
+                reviewed_by = ?,
+                reviewed_username = ?,
+                review_note = ?,
+                reviewed_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+            RETURNING id, request_type, target, payload, status,
+                      requested_by, requested_username, reviewed_by, reviewed_username,
+                      review_note, execution_result, created_at, reviewed_at, executed_at
+            """,
+            (
+                new_status,
+                admin["id"],
+                admin["username"],
+                (data.review_note or "").strip() or None,
+                approval_id,
+            ),
+        ).fetchone()
+        conn.commit()
+    finally:
+        conn.close()
 
     write_audit_log(
         admin,
@@ -1616,20 +1864,20 @@ def get_stats():
         FROM (
             SELECT
                 COUNT(*) AS total_products,
-                SUM(CASE WHEN kategori = 'metal' THEN 1 ELSE 0 END) AS metal_products,
-                SUM(CASE WHEN kategori IN ('ahsap', 'ahşap') THEN 1 ELSE 0 END) AS ahsap_products,
-                SUM(CASE WHEN kategori = 'cam' THEN 1 ELSE 0 END) AS cam_products,
-                SUM(CASE WHEN kategori = 'harita' THEN 1 ELSE 0 END) AS harita_products,
-                SUM(CASE WHEN kategori = 'mobilya' THEN 1 ELSE 0 END) AS mobilya_products,
-                SUM(CASE WHEN en IS NOT NULL AND boy IS NOT NULL THEN 1 ELSE 0 END) AS products_with_dims,
-                SUM(CASE WHEN en IS NULL OR boy IS NULL THEN 1 ELSE 0 END) AS products_without_dims
+                COUNT(*) FILTER (WHERE kategori = 'metal') AS metal_products,
+                COUNT(*) FILTER (WHERE kategori IN ('ahsap', 'ahşap')) AS ahsap_products,
+                COUNT(*) FILTER (WHERE kategori = 'cam') AS cam_products,
+                COUNT(*) FILTER (WHERE kategori = 'harita') AS harita_products,
+                COUNT(*) FILTER (WHERE kategori = 'mobilya') AS mobilya_products,
+                COUNT(*) FILTER (WHERE en IS NOT NULL AND boy IS NOT NULL) AS products_with_dims,
+                COUNT(*) FILTER (WHERE en IS NULL OR boy IS NULL) AS products_without_dims
             FROM products
             WHERE is_active = 1
         ) p
         CROSS JOIN (
             SELECT
                 COUNT(*) AS total_materials,
-                SUM(CASE WHEN unit_price > 0 THEN 1 ELSE 0 END) AS materials_with_price
+                COUNT(*) FILTER (WHERE unit_price > 0) AS materials_with_price
             FROM raw_materials
         ) m
         """
@@ -1685,8 +1933,9 @@ def list_products(
         where_clauses.append("kategori = ?")
         params.append(kategori)
     if search:
-        where_clauses.append("(child_name LIKE ? OR child_sku LIKE ? OR child_code LIKE ?)")
-        params.extend([f"%{search}%"] * 3)
+        # Trigram index'in kurulduğu ifadeyle birebir aynı olmalı (database.py).
+        where_clauses.append(f"({PRODUCT_SEARCH_EXPR}) LIKE ?")
+        params.append(f"%{search}%")
     if parent_name:
         where_clauses.append("parent_name = ?")
         params.append(parent_name)
@@ -1713,11 +1962,11 @@ def list_products(
     total = 0
     products = []
     if rows:
+        # Satırlar zaten dict; kopya üretmeden _total_count alanı ayıklanır.
         total = int(rows[0].get("_total_count") or 0)
         for row in rows:
-            d = dict(row)
-            d.pop("_total_count", None)
-            products.append(d)
+            row.pop("_total_count", None)
+        products = rows
     elif page > 1:
         total = row_first_value(conn.execute(f"SELECT COUNT(*) FROM products WHERE {where_sql}", params).fetchone()) or 0
     conn.close()
@@ -1815,31 +2064,44 @@ def update_product_raw_cost_status(
 def get_product(child_sku: str):
     """Tek bir ürünün detaylarını döndürür (hammaddeler ve maliyetler dahil)."""
     conn = get_db()
+    # Hammadde + maliyet listeleri jsonb_agg ile ana satıra gömülür; üç ayrı
+    # round-trip yerine tek sorgu (Supabase latency optimizasyonu).
     product = conn.execute(
-        "SELECT * FROM products WHERE child_sku = ? AND is_active = 1",
+        """
+        SELECT p.*,
+               (
+                   SELECT COALESCE(jsonb_agg(jsonb_build_object(
+                       'id', pm.id, 'child_sku', pm.child_sku,
+                       'material_id', pm.material_id, 'quantity', pm.quantity,
+                       'name', rm.name, 'unit', rm.unit,
+                       'unit_price', rm.unit_price, 'currency', rm.currency
+                   )), '[]'::jsonb)
+                   FROM product_materials pm
+                   JOIN raw_materials rm ON pm.material_id = rm.id
+                   WHERE pm.child_sku = p.child_sku
+               ) AS materials,
+               (
+                   SELECT COALESCE(jsonb_agg(jsonb_build_object(
+                       'id', pc.id, 'child_sku', pc.child_sku,
+                       'cost_name', pc.cost_name, 'assigned', pc.assigned
+                   )), '[]'::jsonb)
+                   FROM product_costs pc
+                   WHERE pc.child_sku = p.child_sku
+               ) AS costs
+        FROM products p
+        WHERE p.child_sku = ? AND p.is_active = 1
+        """,
         (child_sku,),
     ).fetchone()
+    conn.close()
     if not product:
-        conn.close()
         raise HTTPException(status_code=404, detail="Ürün bulunamadı")
 
     product_dict = dict(product)
-
-    # Hammadde + maliyet sorgularını tek seferde çek (2 sorgu yerine UNION kullanılamaz
-    # çünkü farklı şemalar, ama en azından tek bağlantıda sırayla)
-    materials = conn.execute("""
-        SELECT pm.*, rm.name, rm.unit, rm.unit_price, rm.currency
-        FROM product_materials pm
-        JOIN raw_materials rm ON pm.material_id = rm.id
-        WHERE pm.child_sku = ?
-    """, (child_sku,)).fetchall()
-    costs = conn.execute(
-        "SELECT * FROM product_costs WHERE child_sku = ?", (child_sku,)
-    ).fetchall()
-    conn.close()
-
-    product_dict["materials"] = [dict(m) for m in materials]
-    product_dict["costs"] = [dict(c) for c in costs]
+    # psycopg jsonb kolonlarını genelde listeye açar; açmadığı sürücü
+    # kombinasyonları için parse_json_text devreye girer.
+    product_dict["materials"] = parse_json_text(product_dict.get("materials")) or []
+    product_dict["costs"] = parse_json_text(product_dict.get("costs")) or []
     return product_dict
 
 
@@ -1918,7 +2180,8 @@ def list_product_groups(
     total = 0
     groups: list[dict] = []
     if rows:
-        groups = [dict(r) for r in rows]
+        # Satırlar zaten dict; kopya üretmeden total_count alanı ayıklanır.
+        groups = rows
         total = int(groups[0].get("total_count") or 0)
         for row in groups:
             row.pop("total_count", None)
@@ -1976,11 +2239,12 @@ def search_parent_products(
 
     search_text = (q or "").strip().lower()
     if search_text:
+        # Tek birleşik ifade + tek parametre: satır başına iki LIKE taraması
+        # yerine bir tarama, parametre kopyası da tek.
         where_clauses.append(
-            "(LOWER(COALESCE(product_identifier, '')) LIKE ? OR LOWER(COALESCE(parent_name, '')) LIKE ?)"
+            "LOWER(COALESCE(product_identifier, '') || ' ' || COALESCE(parent_name, '')) LIKE ?"
         )
-        like = f"%{search_text}%"
-        params.extend([like, like])
+        params.append(f"%{search_text}%")
 
     where_sql = " AND ".join(where_clauses)
     rows = conn.execute(
@@ -2268,7 +2532,8 @@ def list_materials():
     conn = get_db()
     rows = conn.execute("SELECT * FROM raw_materials ORDER BY name").fetchall()
     conn.close()
-    return [dict(r) for r in rows]
+    # Satırlar sürücüden zaten dict olarak gelir; kopyalamadan döndürülür.
+    return rows
 
 
 @app.post("/api/materials")
@@ -2284,22 +2549,19 @@ def create_material(data: RawMaterialCreate, request: Request):
 
     conn = get_db()
     try:
-        cur = conn.execute("""
+        row = conn.execute("""
             INSERT INTO raw_materials (name, unit, unit_price, currency)
             VALUES (?, ?, ?, ?)
-        """, (name, unit, float(data.unit_price), data.currency))
-        row = conn.execute(
-            "SELECT * FROM raw_materials WHERE id = ?",
-            (cur.lastrowid,),
-        ).fetchone()
+            RETURNING *
+        """, (name, unit, float(data.unit_price), data.currency)).fetchone()
         conn.commit()
     except DBIntegrityError:
-        conn.close()
         raise HTTPException(status_code=409, detail="Bu hammadde adı zaten kayıtlı")
-    conn.close()
-    created = dict(row)
+    finally:
+        conn.close()
+    invalidate_product_groups_cache()
     write_audit_log(admin, "materials.create", target=name, details={"unit": unit})
-    return created
+    return row
 
 
 @app.put("/api/materials/{material_id}")
@@ -2316,6 +2578,7 @@ def update_material(material_id: int, data: RawMaterialUpdate, request: Request)
         raise HTTPException(status_code=404, detail="Hammadde bulunamadı")
     conn.commit()
     conn.close()
+    invalidate_product_groups_cache()
     write_audit_log(admin, "materials.update", target=str(material_id), details={"unit_price": data.unit_price, "currency": data.currency})
     return {"status": "ok"}
 
@@ -2337,6 +2600,7 @@ def delete_material(material_id: int, request: Request):
     conn.execute("DELETE FROM raw_materials WHERE id = ?", (material_id,))
     conn.commit()
     conn.close()
+    invalidate_product_groups_cache()
     write_audit_log(admin, "materials.delete", target=row["name"])
     return {"status": "ok", "deleted_material": row["name"]}
 
@@ -2355,6 +2619,7 @@ def set_product_material(entry: ProductMaterialEntry):
     set_products_raw_cost_status(conn, [entry.child_sku], RAW_COST_STATUS_DONE)
     conn.commit()
     conn.close()
+    invalidate_product_groups_cache()
     return {"status": "ok"}
 
 
@@ -2365,15 +2630,20 @@ def set_product_material_bulk(entry: ProductMaterialBulk):
     Aynı parent altındaki renk varyantları için idealdir.
     """
     conn = get_db()
-    for sku in entry.child_skus:
-        conn.execute("""
-            INSERT INTO product_materials (child_sku, material_id, quantity)
-            VALUES (?, ?, ?)
-            ON CONFLICT(child_sku, material_id) DO UPDATE SET quantity = ?
-        """, (sku, entry.material_id, entry.quantity, entry.quantity))
+    # Tek executemany + tek commit: SKU başına ayrı execute'un N+1 yazma
+    # maliyetini ortadan kaldırır.
+    conn.executemany("""
+        INSERT INTO product_materials (child_sku, material_id, quantity)
+        VALUES (?, ?, ?)
+        ON CONFLICT(child_sku, material_id) DO UPDATE SET quantity = ?
+    """, [
+        (sku, entry.material_id, entry.quantity, entry.quantity)
+        for sku in entry.child_skus
+    ])
     set_products_raw_cost_status(conn, entry.child_skus, RAW_COST_STATUS_DONE)
     conn.commit()
     conn.close()
+    invalidate_product_groups_cache()
     return {"status": "ok", "updated": len(entry.child_skus)}
 
 
@@ -2382,14 +2652,15 @@ def get_product_materials(child_sku: str):
     """Bir ürünün tüm hammadde miktarlarını döndürür."""
     conn = get_db()
     rows = conn.execute("""
-        SELECT pm.*, rm.name, rm.unit, rm.unit_price, rm.currency
+        SELECT pm.id, pm.child_sku, pm.material_id, pm.quantity,
+               rm.name, rm.unit, rm.unit_price, rm.currency
         FROM product_materials pm
         JOIN raw_materials rm ON pm.material_id = rm.id
         WHERE pm.child_sku = ?
         ORDER BY rm.name
     """, (child_sku,)).fetchall()
     conn.close()
-    return [dict(r) for r in rows]
+    return rows
 
 
 # ─────────────────────────── COST ASSIGNMENTS ───────────────────────────
@@ -2426,23 +2697,19 @@ def create_cost_definition(data: CostDefinitionCreate, request: Request):
 
     conn = get_db()
     try:
-        cur = conn.execute("""
+        row = conn.execute("""
             INSERT INTO cost_definitions (name, category, kargo_code, is_active, source, updated_at)
             VALUES (?, ?, ?, ?, 'manual', CURRENT_TIMESTAMP)
-        """, (name, category, kargo_code, int(data.is_active)))
-        row = conn.execute("""
-            SELECT id, name, category, kargo_code, is_active, source, created_at, updated_at
-            FROM cost_definitions
-            WHERE id = ?
-        """, (cur.lastrowid,)).fetchone()
+            RETURNING id, name, category, kargo_code, is_active, source, created_at, updated_at
+        """, (name, category, kargo_code, int(data.is_active))).fetchone()
         conn.commit()
     except DBIntegrityError:
         conn.close()
         raise HTTPException(status_code=409, detail="Bu maliyet adı zaten mevcut")
     conn.close()
-    created = dict(row)
+    invalidate_cost_definitions_cache()
     write_audit_log(admin, "costs.create", target=name, details={"category": category, "kargo_code": kargo_code})
-    return created
+    return row
 
 
 @app.put("/api/cost-definitions/{cost_id}")
@@ -2478,30 +2745,25 @@ def update_cost_definition(cost_id: int, data: CostDefinitionUpdate, request: Re
     else:
         new_kargo_code = None
 
-    conflict = conn.execute(
-        "SELECT id FROM cost_definitions WHERE name = ? AND id <> ?",
-        (new_name, cost_id),
-    ).fetchone()
-    if conflict:
+    # İsim çakışması ayrı SELECT ile değil UNIQUE kısıtından yakalanır;
+    # rollback merge_product_cost_name'in taşımalarını da geri alır.
+    try:
+        merge_product_cost_name(conn, existing["name"], new_name)
+        row = conn.execute("""
+            UPDATE cost_definitions
+            SET name = ?, category = ?, kargo_code = ?, is_active = ?, updated_at = CURRENT_TIMESTAMP
+            WHERE id = ?
+            RETURNING id, name, category, kargo_code, is_active, source, created_at, updated_at
+        """, (new_name, new_category, new_kargo_code, new_is_active, cost_id)).fetchone()
+        conn.commit()
+    except DBIntegrityError:
+        conn.rollback()
         conn.close()
         raise HTTPException(status_code=409, detail="Bu maliyet adı zaten mevcut")
-
-    merge_product_cost_name(conn, existing["name"], new_name)
-    conn.execute("""
-        UPDATE cost_definitions
-        SET name = ?, category = ?, kargo_code = ?, is_active = ?, updated_at = CURRENT_TIMESTAMP
-        WHERE id = ?
-    """, (new_name, new_category, new_kargo_code, new_is_active, cost_id))
-    row = conn.execute("""
-        SELECT id, name, category, kargo_code, is_active, source, created_at, updated_at
-        FROM cost_definitions
-        WHERE id = ?
-    """, (cost_id,)).fetchone()
-    conn.commit()
     conn.close()
-    updated = dict(row)
-    write_audit_log(admin, "costs.update", target=updated["name"], details={"cost_id": cost_id})
-    return updated
+    invalidate_cost_definitions_cache()
+    write_audit_log(admin, "costs.update", target=row["name"], details={"cost_id": cost_id})
+    return row
 
 
 @app.delete("/api/cost-definitions/{cost_id}")
@@ -2509,18 +2771,22 @@ def delete_cost_definition(cost_id: int, request: Request):
     """Maliyet tanımını ve ilişkili ürün maliyet atamalarını siler."""
     admin = require_admin_user(request)
     conn = get_db()
-    row = conn.execute(
-        "SELECT id, name FROM cost_definitions WHERE id = ?",
-        (cost_id,),
-    ).fetchone()
-    if not row:
-        conn.close()
-        raise HTTPException(status_code=404, detail="Maliyet tanımı bulunamadı")
+    try:
+        row = conn.execute(
+            "SELECT id, name FROM cost_definitions WHERE id = ?",
+            (cost_id,),
+        ).fetchone()
+        if not row:
+            raise HTTPException(status_code=404, detail="Maliyet tanımı bulunamadı")
 
-    conn.execute("DELETE FROM product_costs WHERE cost_name = ?", (row["name"],))
-    conn.execute("DELETE FROM cost_definitions WHERE id = ?", (cost_id,))
-    conn.commit()
-    conn.close()
+        # İki DELETE tek transaction'da gider; product_costs tarafı
+        # idx_product_costs_cost_name sayesinde index taramasıyla çalışır.
+        conn.execute("DELETE FROM product_costs WHERE cost_name = ?", (row["name"],))
+        conn.execute("DELETE FROM cost_definitions WHERE id = ?", (cost_id,))
+        conn.commit()
+    finally:
+        conn.close()
+    invalidate_cost_definitions_cache()
     write_audit_log(admin, "costs.delete", target=row["name"])
     return {"status": "ok", "deleted_cost": row["name"]}
 
@@ -2538,17 +2804,14 @@ def get_kaplama_suggestions(parent_name: str):
     Öneri, geçmiş atamalardaki isim benzerliği + boyut eşleşmesi skoruna göre hesaplanır.
     """
     conn = get_db()
-    target_rows = conn.execute("""
-        SELECT child_sku, child_name, variation_size, kategori
+    # Hedef + geçmiş satırları tek sorguda (UNION ALL + tag kolonu) çekilir;
+    # iki ayrı round-trip yerine bir tane (Supabase latency optimizasyonu).
+    rows = conn.execute("""
+        SELECT 't' AS tag, child_name, variation_size, kategori, NULL AS cost_name
         FROM products
         WHERE parent_name = ? AND is_active = 1
-    """, (parent_name,)).fetchall()
-    if not target_rows:
-        conn.close()
-        raise HTTPException(status_code=404, detail="Bu parent altında ürün bulunamadı")
-
-    hist_rows = conn.execute("""
-        SELECT p.child_name, p.variation_size, p.kategori, pc.cost_name
+        UNION ALL
+        SELECT 'h' AS tag, p.child_name, p.variation_size, p.kategori, pc.cost_name
         FROM product_costs pc
         JOIN products p ON p.child_sku = pc.child_sku
         JOIN cost_definitions cd ON cd.name = pc.cost_name
@@ -2557,9 +2820,14 @@ def get_kaplama_suggestions(parent_name: str):
           AND cd.is_active = 1
           AND p.is_active = 1
           AND p.parent_name <> ?
-    """, (parent_name,)).fetchall()
+    """, (parent_name, parent_name)).fetchall()
     conn.close()
 
+    target_rows = [r for r in rows if r["tag"] == "t"]
+    hist_rows = [r for r in rows if r["tag"] == "h"]
+    if not target_rows:
+        raise HTTPException(status_code=404, detail="Bu parent altında ürün bulunamadı")
+
     targets_by_size = {}
     for row in target_rows:
         size = row["variation_size"] or "(boyutsuz)"
@@ -2575,28 +2843,53 @@ def get_kaplama_suggestions(parent_name: str):
     if not hist_rows:
         return {"parent_name": parent_name, "suggestions": {}}
 
-    hist_samples = []
-    freq_by_size = defaultdict(lambda: defaultdict(int))
-    freq_by_kategori = defaultdict(lambda: defaultdict(int))
+    # Tekrarlayan geçmiş satırları tekilleştirilip sayıyla ağırlıklandırılır.
+    sample_counts: dict[tuple, int] = {}
+    # İki seviyeli defaultdict yerine bileşik anahtarlı Counter: her artışta
+    # çifte __missing__ + lambda maliyeti yerine tek C-seviyesi sayaç.
+    freq_by_size: Counter = Counter()
+    freq_by_kategori: Counter = Counter()
 
     for row in hist_rows:
         h_size = row["variation_size"] or "(boyutsuz)"
         h_kategori = row["kategori"] or ""
         cost_name = row["cost_name"]
-        h_tokens = tokenize_text(row["child_name"])
-        h_tokens.update(tokenize_text(h_size))
-        hist_samples.append((h_size, h_kategori, cost_name, h_tokens))
-        freq_by_size[h_size][cost_name] += 1
-        freq_by_kategori[h_kategori][cost_name] += 1
-
-    suggestions = {}
-    for size, info in targets_by_size.items():
-        t_tokens = info["tokens"]
-        t_kategori = info["kategori"] or ""
-        score_map = defaultdict(lambda: {"score": 0, "hits": 0, "size_hits": 0, "token_hits": 0})
-
-        for h_size, h_kategori, cost_name, h_tokens in hist_samples:
-            overlap = len(t_tokens & h_tokens) if t_tokens else 0
+        h_tokens = tokenize_text(row["child_name"]) | tokenize_text(h_size)
+        sample_key = (h_size, h_kategori, cost_name, h_tokens)
+        sample_counts[sample_key] = sample_counts.get(sample_key, 0) + 1
+        freq_by_size[(h_size, cost_name)] += 1
+        freq_by_kategori[(h_kategori, cost_name)] += 1
+
+    # Fallback seçimleri için dış anahtar başına en sık maliyet tek geçişte çıkarılır.
+    best_cost_by_size: dict[str, tuple[int, str]] = {}
+    for (h_size, cost_name), cnt in freq_by_size.items():
+        cur = best_cost_by_size.get(h_size)
+        if cur is None or cnt > cur[0]:
+            best_cost_by_size[h_size] = (cnt, cost_name)
+    best_cost_by_kategori: dict[str, tuple[int, str]] = {}
+    for (h_kategori, cost_name), cnt in freq_by_kategori.items():
+        cur = best_cost_by_kategori.get(h_kategori)
+        if cur is None or cnt > cur[0]:
+            best_cost_by_kategori[h_kategori] = (cnt, cost_name)
+
+    # Ters yineleme: dış döngü (çok sayıdaki) geçmiş örnekleri bir kez gezer,
+    # iç döngü (az sayıdaki) hedef boyutlara dağıtır. Hedef token kümeleri
+    # örnek başına yeniden kurulmaz.
+    # Token kümeleri bit maskelerine paketlenir; iç döngüdeki kesişim
+    # set işlemi yerine tek (mask & mask).bit_count() çağrısına iner.
+    token_id: dict[str, int] = {}
+    target_infos = [
+        (size, _token_mask(info["tokens"], token_id), info["kategori"] or "")
+        for size, info in targets_by_size.items()
+    ]
+    score_maps: dict[str, dict] = {
+        size: defaultdict(lambda: {"score": 0, "hits": 0, "size_hits": 0, "token_hits": 0})
+        for size in targets_by_size
+    }
+    for (h_size, h_kategori, cost_name, h_tokens), h_count in sample_counts.items():
+        h_mask = _token_mask(h_tokens, token_id)
+        for size, t_mask, t_kategori in target_infos:
+            overlap = (t_mask & h_mask).bit_count()
             score = 0
             if h_size == size:
                 score += 5
@@ -2607,17 +2900,23 @@ def get_kaplama_suggestions(parent_name: str):
             if score <= 0:
                 continue
 
-            m = score_map[cost_name]
-            m["score"] += score
-            m["hits"] += 1
-            m["token_hits"] += overlap
+            m = score_maps[size][cost_name]
+            m["score"] += score * h_count
+            m["hits"] += h_count
+            m["token_hits"] += overlap * h_count
             if h_size == size:
-                m["size_hits"] += 1
+                m["size_hits"] += h_count
+
+    suggestions = {}
+    for size, info in targets_by_size.items():
+        t_kategori = info["kategori"] or ""
+        score_map = score_maps[size]
 
         selected_cost = None
         selected_meta = None
         if score_map:
-            ranked = sorted(
+            # Yalnızca en iyi eleman gerekli; sort (O(N log N)) yerine max (O(N)).
+            selected_cost, selected_meta = max(
                 score_map.items(),
                 key=lambda kv: (
                     kv[1]["score"],
@@ -2625,15 +2924,13 @@ def get_kaplama_suggestions(parent_name: str):
                     kv[1]["token_hits"],
                     kv[1]["hits"],
                 ),
-                reverse=True,
             )
-            selected_cost, selected_meta = ranked[0]
         else:
-            if freq_by_size.get(size):
-                selected_cost, cnt = max(freq_by_size[size].items(), key=lambda kv: kv[1])
+            if size in best_cost_by_size:
+                cnt, selected_cost = best_cost_by_size[size]
                 selected_meta = {"score": cnt * 4, "hits": cnt, "size_hits": cnt, "token_hits": 0}
-            elif freq_by_kategori.get(t_kategori):
-                selected_cost, cnt = max(freq_by_kategori[t_kategori].items(), key=lambda kv: kv[1])
+            elif t_kategori in best_cost_by_kategori:
+                cnt, selected_cost = best_cost_by_kategori[t_kategori]
                 selected_meta = {"score": cnt * 2, "hits": cnt, "size_hits": 0, "token_hits": 0}
 
         if not selected_cost or not selected_meta:
@@ -2663,17 +2960,14 @@ def get_kaplama_name_suggestions(parent_name: str):
     Seçili parent için ürün adına + renk tier'ına göre kaplama maliyet önerisi üretir.
     """
     conn = get_db()
-    target_rows = conn.execute("""
-        SELECT child_sku, child_name, variation_size, variation_color, kategori
+    # Hedef + geçmiş satırları tek sorguda (UNION ALL + tag kolonu) çekilir;
+    # kaplama tanımları da aynı bağlantıdan okunur — üç round-trip yerine iki.
+    rows = conn.execute("""
+        SELECT 't' AS tag, child_sku, child_name, variation_size, variation_color, kategori, NULL AS cost_name
         FROM products
         WHERE parent_name = ? AND is_active = 1
-    """, (parent_name,)).fetchall()
-    if not target_rows:
-        conn.close()
-        raise HTTPException(status_code=404, detail="Bu parent altında ürün bulunamadı")
-
-    hist_rows = conn.execute("""
-        SELECT p.child_name, p.variation_size, p.variation_color, p.kategori, pc.cost_name
+        UNION ALL
+        SELECT 'h' AS tag, NULL, p.child_name, p.variation_size, p.variation_color, p.kategori, pc.cost_name
         FROM product_costs pc
         JOIN products p ON p.child_sku = pc.child_sku
         JOIN cost_definitions cd ON cd.name = pc.cost_name
@@ -2682,13 +2976,19 @@ def get_kaplama_name_suggestions(parent_name: str):
           AND cd.is_active = 1
           AND p.is_active = 1
           AND p.parent_name <> ?
-    """, (parent_name,)).fetchall()
+    """, (parent_name, parent_name)).fetchall()
     conn.close()
 
-    kaplama_defs = list_cost_definitions(active_only=True, category="kaplama")
-    kaplama_cost_names = [d["name"] for d in kaplama_defs if d.get("name")]
-    kaplama_tokens = {name: tokenize_text(name) for name in kaplama_cost_names}
-    kaplama_tier_by_cost = {name: detect_kaplama_tier(name) for name in kaplama_cost_names}
+    target_rows = [r for r in rows if r["tag"] == "t"]
+    hist_rows = [r for r in rows if r["tag"] == "h"]
+    if not target_rows:
+        raise HTTPException(status_code=404, detail="Bu parent altında ürün bulunamadı")
+
+    # Tanım isimleri + token/tier haritaları versiyonlu indeksten gelir;
+    # list_cost_definitions boş tabloda template sync fallback'ini zaten yapar.
+    kaplama_cost_names, kaplama_tokens, kaplama_tier_by_cost = _kaplama_token_index(
+        get_cost_definitions_version()
+    )
 
     target_by_key = {}
     for row in target_rows:
@@ -2696,8 +2996,7 @@ def get_kaplama_name_suggestions(parent_name: str):
         if not name:
             continue
         color = (row["variation_color"] or "").strip()
-        tier = detect_kaplama_tier(name, color)
-        key = build_kaplama_group_key(name, tier)
+        tier, key, _ = _kaplama_signature(name, color)
         entry = target_by_key.setdefault(key, {
             "name": name,
             "tier": tier,
@@ -2717,9 +3016,12 @@ def get_kaplama_name_suggestions(parent_name: str):
     if not target_by_key:
         return {"parent_name": parent_name, "suggestions": {}}
 
-    hist_samples = []
-    freq_by_kategori = defaultdict(lambda: defaultdict(int))
-    freq_by_tier = defaultdict(lambda: defaultdict(int))
+    # Aynı (isim, kategori, tier, maliyet, token kümesi) kombinasyonu geçmişte
+    # yüzlerce kez tekrarlar; örnekler tekilleştirilip sayıyla ağırlıklandırılır.
+    # Skor döngüsü böylece satır sayısı yerine benzersiz örnek sayısı kadar döner.
+    sample_counts: dict[tuple, int] = {}
+    freq_by_kategori: Counter = Counter()
+    freq_by_tier: Counter = Counter()
     for row in hist_rows:
         h_name = (row["child_name"] or "").strip()
         h_size = row["variation_size"] or "(boyutsuz)"
@@ -2727,26 +3029,49 @@ def get_kaplama_name_suggestions(parent_name: str):
         h_kategori = row["kategori"] or ""
         h_tier = detect_kaplama_tier(h_name, h_color, row["cost_name"])
         cost_name = row["cost_name"]
-        h_tokens = tokenize_text(h_name)
-        h_tokens.update(tokenize_text(h_size))
-        h_tokens.update(tokenize_text(h_color))
-        hist_samples.append((h_name, h_size, h_color, h_kategori, h_tier, cost_name, h_tokens))
-        freq_by_kategori[h_kategori][cost_name] += 1
-        freq_by_tier[h_tier][cost_name] += 1
+        h_tokens = tokenize_text(h_name) | tokenize_text(h_size) | tokenize_text(h_color)
+        sample_key = (h_name.lower(), h_kategori, h_tier, cost_name, h_tokens)
+        sample_counts[sample_key] = sample_counts.get(sample_key, 0) + 1
+        freq_by_kategori[(h_kategori, cost_name)] += 1
+        freq_by_tier[(h_tier, cost_name)] += 1
+
+    best_cost_by_kategori: dict[str, tuple[int, str]] = {}
+    for (h_kategori, cost_name), cnt in freq_by_kategori.items():
+        cur = best_cost_by_kategori.get(h_kategori)
+        if cur is None or cnt > cur[0]:
+            best_cost_by_kategori[h_kategori] = (cnt, cost_name)
+    best_cost_by_tier: dict[str, tuple[int, str]] = {}
+    for (h_tier, cost_name), cnt in freq_by_tier.items():
+        cur = best_cost_by_tier.get(h_tier)
+        if cur is None or cnt > cur[0]:
+            best_cost_by_tier[h_tier] = (cnt, cost_name)
+    # Token kümeleri bit maskelerine paketlenir; skor döngülerindeki kesişim
+    # (mask & mask).bit_count() ile tek işlemde hesaplanır.
+    token_id: dict[str, int] = {}
+    hist_samples = [
+        (key[0], key[1], key[2], key[3], _token_mask(key[4], token_id), count)
+        for key, count in sample_counts.items()
+    ]
+    kaplama_masks = {
+        cost_name: _token_mask(c_tokens, token_id)
+        for cost_name, c_tokens in kaplama_tokens.items()
+    }
 
     suggestions = {}
     for target_key, info in target_by_key.items():
         name = info["name"]
+        name_cf = name.lower()
         tier = info["tier"]
         t_tokens = set(info["tokens"])
         for sz in info["sizes"]:
             t_tokens.update(tokenize_text(sz))
+        t_mask = _token_mask(t_tokens, token_id)
         t_kategori = info["kategori"]
         score_map = defaultdict(lambda: {"score": 0, "hits": 0, "direct_hits": 0, "name_hits": 0, "tier_hits": 0})
 
         # 1) Ürün adı ile maliyet adı token benzerliği
-        for cost_name, c_tokens in kaplama_tokens.items():
-            overlap = len(t_tokens & c_tokens)
+        for cost_name, c_mask in kaplama_masks.items():
+            overlap = (t_mask & c_mask).bit_count()
             if overlap <= 0:
                 continue
             m = score_map[cost_name]
@@ -2761,32 +3086,32 @@ def get_kaplama_name_suggestions(parent_name: str):
                 elif c_tier != "other":
                     m["score"] -= 7
 
-        # 2) Geçmiş ürün atamalarıyla isim benzerliği
-        for h_name, h_size, h_color, h_kategori, h_tier, cost_name, h_tokens in hist_samples:
-            overlap = len(t_tokens & h_tokens) if t_tokens else 0
-            if overlap <= 0 and h_name.lower() != name.lower():
+        # 2) Geçmiş ürün atamalarıyla isim benzerliği (örnek ağırlıklı)
+        for h_name_cf, h_kategori, h_tier, cost_name, h_mask, h_count in hist_samples:
+            overlap = (t_mask & h_mask).bit_count()
+            if overlap <= 0 and h_name_cf != name_cf:
                 continue
             m = score_map[cost_name]
             add = overlap * 3
-            if h_name.lower() == name.lower():
+            if h_name_cf == name_cf:
                 add += 10
-                m["name_hits"] += 1
+                m["name_hits"] += h_count
             if t_kategori and h_kategori == t_kategori:
                 add += 2
             if tier != "other":
                 if h_tier == tier:
                     add += 3
-                    m["tier_hits"] += 1
+                    m["tier_hits"] += h_count
                 elif h_tier != "other":
                     add -= 2
-            m["score"] += add
-            m["hits"] += 1
+            m["score"] += add * h_count
+            m["hits"] += h_count
 
         selected_cost = None
         selected_meta = None
 
         if score_map:
-            ranked = sorted(
+            selected_cost, selected_meta = max(
                 score_map.items(),
                 key=lambda kv: (
                     kv[1]["score"],
@@ -2795,16 +3120,14 @@ def get_kaplama_name_suggestions(parent_name: str):
                     kv[1]["direct_hits"],
                     kv[1]["hits"],
                 ),
-                reverse=True,
             )
-            selected_cost, selected_meta = ranked[0]
         else:
             # Tier/kategori bazlı fallback
-            if tier != "other" and freq_by_tier.get(tier):
-                selected_cost, cnt = max(freq_by_tier[tier].items(), key=lambda kv: kv[1])
+            if tier != "other" and tier in best_cost_by_tier:
+                cnt, selected_cost = best_cost_by_tier[tier]
                 selected_meta = {"score": cnt * 3, "hits": cnt, "direct_hits": 0, "name_hits": 0, "tier_hits": cnt}
-            elif freq_by_kategori.get(t_kategori):
-                selected_cost, cnt = max(freq_by_kategori[t_kategori].items(), key=lambda kv: kv[1])
+            elif t_kategori in best_cost_by_kategori:
+                cnt, selected_cost = best_cost_by_kategori[t_kategori]
                 selected_meta = {"score": cnt * 2, "hits": cnt, "direct_hits": 0, "name_hits": 0, "tier_hits": 0}
 
         if not selected_cost or not selected_meta:
@@ -2843,6 +3166,7 @@ def set_product_cost(entry: ProductCostAssignment, request: Request):
     """, (entry.child_sku, entry.cost_name, int(entry.assigned), int(entry.assigned)))
     conn.commit()
     conn.close()
+    invalidate_product_groups_cache()
     write_audit_log(
         user,
         "costs.assign",
@@ -2856,6 +3180,37 @@ def set_product_cost(entry: ProductCostAssignment, request: Request):
     return {"status": "ok"}
 
 
+@app.post("/api/product-costs/bulk")
+def set_product_cost_bulk(entries: list[ProductCostAssignment], request: Request):
+    """Birden fazla ürüne maliyet (ambalaj) atamasını tek transaction'da yapar."""
+    user = require_request_user(request)
+    if not entries:
+        raise HTTPException(status_code=400, detail="En az bir atama girilmelidir")
+
+    conn = get_db()
+    conn.executemany("""
+        INSERT INTO product_costs (child_sku, cost_name, assigned)
+        VALUES (?, ?, ?)
+        ON CONFLICT(child_sku, cost_name) DO UPDATE SET assigned = ?
+    """, [
+        (entry.child_sku, entry.cost_name, int(entry.assigned), int(entry.assigned))
+        for entry in entries
+    ])
+    conn.commit()
+    conn.close()
+    invalidate_product_groups_cache()
+    write_audit_log(
+        user,
+        "costs.assign_bulk",
+        target=f"{len(entries)} atama",
+        details={
+            "count": len(entries),
+            "child_skus": sorted({entry.child_sku for entry in entries})[:50],
+        },
+    )
+    return {"status": "ok", "updated": len(entries)}
+
+
 @app.post("/api/cost-propagation/apply")
 def apply_cost_propagation(data: CostPropagationRequest, request: Request):
     """
@@ -2919,7 +3274,7 @@ def apply_cost_propagation(data: CostPropagationRequest, request: Request):
         if not parent_name:
             parent_name = f"Parent {parent_id:g}"
 
-        payload_json = json.dumps(normalized_payload, ensure_ascii=False, separators=(",", ":"))
+        payload_json = json_dumps_compact(normalized_payload)
         conn.execute(
             """
             INSERT INTO parent_cost_profiles
@@ -3016,13 +3371,21 @@ def apply_cost_propagation(data: CostPropagationRequest, request: Request):
 
 # ─────────────────────── PARENT-TO-CHILD INHERITANCE ───────────────────────
 
+# Tüm malzeme isim işaretleri tek derlenmiş regex'le aranır; dört ayrı
+# substring/startswith taraması yerine C tarafında tek geçiş.
+_MATERIAL_FLAG_RE = re.compile(
+    r"(?P<sac>^(?:saç|sac))|(?P<mdf>^mdf)|(?P<strafor>strafor)|(?P<boya>boya)|(?P<iscilik>işçilik|iscilik)"
+)
+
+
+@lru_cache(maxsize=2048)
 def _material_flags(name: str | None) -> tuple[bool, bool, bool, bool]:
     folded = str(name or "").strip().casefold()
-    boya_iscilik_token = "işçilik".casefold()
-    is_strafor = "strafor" in folded
-    is_boya_iscilik = "boya" in folded and (boya_iscilik_token in folded or "iscilik" in folded)
-    is_sac = folded.startswith("saç".casefold()) or folded.startswith("sac")
-    is_mdf = folded.startswith("mdf")
+    hits = {m.lastgroup for m in _MATERIAL_FLAG_RE.finditer(folded)}
+    is_strafor = "strafor" in hits
+    is_boya_iscilik = "boya" in hits and "iscilik" in hits
+    is_sac = "sac" in hits
+    is_mdf = "mdf" in hits
     return is_strafor, is_boya_iscilik, is_sac, is_mdf
 
 
@@ -3036,7 +3399,7 @@ def get_parent_inheritance_prefill(parent_name: str):
     try:
         children = conn.execute(
             """
-            SELECT child_sku, child_name, variation_size, variation_color, alan_m2, kargo_agirlik, kargo_kodu
+            SELECT child_sku, child_name, variation_size, variation_color, kargo_kodu
             FROM products
             WHERE parent_name = ? AND is_active = 1
             """,
@@ -3045,22 +3408,35 @@ def get_parent_inheritance_prefill(parent_name: str):
         if not children:
             raise HTTPException(status_code=404, detail="Bu parent altında ürün bulunamadı")
 
-        child_by_sku = {row["child_sku"]: dict(row) for row in children}
-        kargo_counter_by_size: dict[str, dict[str, int]] = defaultdict(lambda: defaultdict(int))
-        kaplama_counter_by_name: dict[str, dict[str, int]] = defaultdict(lambda: defaultdict(int))
-        weight_counter_by_size: dict[str, dict[float, int]] = defaultdict(lambda: defaultdict(int))
+        child_by_sku = {row["child_sku"]: row for row in children}
+        # Bileşik anahtarlı Counter'lar: iki seviyeli defaultdict'in her artıştaki
+        # çifte __missing__ + lambda maliyetini tek C-seviyesi sayaca indirir.
+        kargo_counter_by_size: Counter = Counter()
+        kaplama_counter_by_name: Counter = Counter()
 
-        for child in children:
-            size = child["variation_size"] or "(boyutsuz)"
-            if child["kargo_agirlik"] is None:
-                continue
-            try:
-                weight = round(float(child["kargo_agirlik"]), 6)
-            except (TypeError, ValueError):
-                continue
-            weight_counter_by_size[size][weight] += 1
+        # Boyut başına en sık ağırlık (mod) doğrudan SQL'de hesaplanır;
+        # Python tarafında satır satır sayaç tutmaya gerek kalmaz.
+        weight_map: dict[str, float] = {}
+        for row in iter_rows(conn.execute(
+            """
+            SELECT variation_size, weight FROM (
+                SELECT COALESCE(NULLIF(variation_size, ''), '(boyutsuz)') AS variation_size,
+                       ROUND(CAST(kargo_agirlik AS numeric), 6) AS weight,
+                       ROW_NUMBER() OVER (
+                           PARTITION BY COALESCE(NULLIF(variation_size, ''), '(boyutsuz)')
+                           ORDER BY COUNT(*) DESC, ROUND(CAST(kargo_agirlik AS numeric), 6)
+                       ) AS rn
+                FROM products
+                WHERE parent_name = ? AND is_active = 1 AND kargo_agirlik IS NOT NULL
+                GROUP BY 1, 2
+            ) ranked
+            WHERE rn = 1
+            """,
+            (parent_name,),
+        )):
+            weight_map[row["variation_size"]] = float(row["weight"])
 
-        cost_rows = conn.execute(
+        cost_rows = iter_rows(conn.execute(
             """
             SELECT pc.child_sku, pc.cost_name, cd.category
             FROM product_costs pc
@@ -3069,7 +3445,7 @@ def get_parent_inheritance_prefill(parent_name: str):
             WHERE p.parent_name = ? AND p.is_active = 1 AND pc.assigned = 1
             """,
             (parent_name,),
-        ).fetchall()
+        ))
 
         for row in cost_rows:
             sku = row["child_sku"]
@@ -3084,14 +3460,14 @@ def get_parent_inheritance_prefill(parent_name: str):
             category = str(row["category"] or "").strip().lower()
             is_kargo = category == "kargo" or bool(normalize_kargo_code(cost_name))
             if is_kargo:
-                kargo_counter_by_size[size][cost_name] += 1
+                kargo_counter_by_size[(size, cost_name)] += 1
                 continue
 
             group_name = child["child_name"] or child["child_sku"] or ""
             tier = detect_kaplama_tier(child["child_name"], child["variation_color"], cost_name)
             group_key = build_kaplama_group_key(group_name, tier)
             if group_key:
-                kaplama_counter_by_name[group_key][cost_name] += 1
+                kaplama_counter_by_name[(group_key, cost_name)] += 1
 
         fallback_kargo_name_by_code: dict[str, str] = {}
         for row in conn.execute(
@@ -3109,93 +3485,91 @@ def get_parent_inheritance_prefill(parent_name: str):
             if not existing or name.casefold() < existing.casefold():
                 fallback_kargo_name_by_code[code] = name
 
+        sizes_with_kargo = {size for size, _ in kargo_counter_by_size}
         for child in children:
             size = child["variation_size"] or "(boyutsuz)"
-            if kargo_counter_by_size.get(size):
+            if size in sizes_with_kargo:
                 continue
             code = normalize_kargo_code(child["kargo_kodu"])
             if not code:
                 continue
             fallback_name = fallback_kargo_name_by_code.get(code)
             if fallback_name:
-                kargo_counter_by_size[size][fallback_name] += 1
+                kargo_counter_by_size[(size, fallback_name)] += 1
 
+        # Boyut başına en sık ad tek geçişte seçilir (eşitlikte casefold sırası).
         cost_map: dict[str, str] = {}
-        for size, counter in kargo_counter_by_size.items():
-            ranked = sorted(counter.items(), key=lambda kv: (-kv[1], kv[0].casefold()))
-            if ranked:
-                cost_map[size] = ranked[0][0]
-
+        best_kargo_rank: dict[str, tuple[int, str]] = {}
+        for (size, cost_name), cnt in kargo_counter_by_size.items():
+            rank = (-cnt, cost_name.casefold())
+            cur = best_kargo_rank.get(size)
+            if cur is None or rank < cur:
+                best_kargo_rank[size] = rank
+                cost_map[size] = cost_name
+
+        # Grup başına tam sıralı liste gerektiğinden tek global sort + gruplama.
         kaplama_name_map: dict[str, list[str]] = {}
-        for group_key, counter in kaplama_counter_by_name.items():
-            ranked = sorted(counter.items(), key=lambda kv: (-kv[1], kv[0].casefold()))
-            names = [name for name, _ in ranked]
-            if names:
-                kaplama_name_map[group_key] = names
-
-        weight_map: dict[str, float] = {}
-        for size, counter in weight_counter_by_size.items():
-            ranked = sorted(counter.items(), key=lambda kv: (-kv[1], kv[0]))
-            if ranked:
-                weight_map[size] = ranked[0][0]
-
-        material_rows = conn.execute(
+        for (group_key, cost_name), _cnt in sorted(
+            kaplama_counter_by_name.items(),
+            key=lambda kv: (kv[0][0], -kv[1], kv[0][1].casefold()),
+        ):
+            kaplama_name_map.setdefault(group_key, []).append(cost_name)
+
+        # Malzeme başına miktar dağılımı SQL'de GROUP BY ile sıkıştırılır; Python
+        # yalnızca malzeme başına bir kez isim bayraklarını uygular. Alan eşleşmesi
+        # (abs_tol=1e-4) FILTER ile aynı sorguda sayılır.
+        material_rows = iter_rows(conn.execute(
             """
-            SELECT pm.child_sku, pm.material_id, pm.quantity, rm.name
+            SELECT pm.material_id, rm.name,
+                   ROUND(CAST(pm.quantity AS numeric), 6) AS quantity,
+                   COUNT(*) AS c,
+                   COUNT(*) FILTER (
+                       WHERE p.alan_m2 IS NOT NULL
+                         AND ABS(ROUND(CAST(pm.quantity AS numeric), 6) - CAST(p.alan_m2 AS numeric)) <= 0.0001
+                   ) AS area_match
             FROM product_materials pm
             JOIN raw_materials rm ON rm.id = pm.material_id
             JOIN products p ON p.child_sku = pm.child_sku
-            WHERE p.parent_name = ? AND p.is_active = 1
+            WHERE p.parent_name = ? AND p.is_active = 1 AND pm.quantity IS NOT NULL
+            GROUP BY pm.material_id, rm.name, 3
             """,
             (parent_name,),
-        ).fetchall()
+        ))
 
         sac_presence: dict[int, int] = defaultdict(int)
         mdf_presence: dict[int, int] = defaultdict(int)
         sac_area_match: dict[int, int] = defaultdict(int)
         mdf_area_match: dict[int, int] = defaultdict(int)
-        quantity_by_material: dict[int, dict[float, int]] = defaultdict(lambda: defaultdict(int))
+        quantity_by_material: Counter = Counter()
 
         for row in material_rows:
             material_id = int(row["material_id"])
-            quantity_raw = row["quantity"]
-            if quantity_raw is None:
-                continue
-            try:
-                quantity = round(float(quantity_raw), 6)
-            except (TypeError, ValueError):
-                continue
+            quantity = float(row["quantity"])
+            count = int(row["c"])
+            area_match = int(row["area_match"])
 
             is_strafor, is_boya_iscilik, is_sac, is_mdf = _material_flags(row["name"])
-            child = child_by_sku.get(row["child_sku"])
-            alan = child.get("alan_m2") if child else None
-            try:
-                alan_value = float(alan) if alan is not None else None
-            except (TypeError, ValueError):
-                alan_value = None
-
             if is_sac:
-                sac_presence[material_id] += 1
-                if alan_value is not None and math.isclose(quantity, alan_value, rel_tol=0, abs_tol=1e-4):
-                    sac_area_match[material_id] += 1
+                sac_presence[material_id] += count
+                if area_match:
+                    sac_area_match[material_id] += area_match
                 continue
             if is_mdf:
-                mdf_presence[material_id] += 1
-                if alan_value is not None and math.isclose(quantity, alan_value, rel_tol=0, abs_tol=1e-4):
-                    mdf_area_match[material_id] += 1
+                mdf_presence[material_id] += count
+                if area_match:
+                    mdf_area_match[material_id] += area_match
                 continue
             if is_strafor or is_boya_iscilik:
                 continue
 
-            quantity_by_material[material_id][quantity] += 1
+            quantity_by_material[(material_id, quantity)] += count
 
         def pick_auto_material(match_counter: dict[int, int], presence_counter: dict[int, int]) -> int | None:
             if match_counter:
-                ranked = sorted(
+                return min(
                     match_counter.items(),
                     key=lambda kv: (-kv[1], -presence_counter.get(kv[0], 0), kv[0]),
-                )
-                return ranked[0][0]
+                )[0]
             if len(presence_counter) == 1:
                 return next(iter(presence_counter))
             return None
@@ -3204,10 +3578,13 @@ def get_parent_inheritance_prefill(parent_name: str):
         mdf_material_id = pick_auto_material(mdf_area_match, mdf_presence)
 
         materials: dict[str, float] = {}
-        for material_id, counter in quantity_by_material.items():
-            ranked = sorted(counter.items(), key=lambda kv: (-kv[1], kv[0]))
-            if ranked:
-                materials[str(material_id)] = ranked[0][0]
+        best_qty_rank: dict[int, tuple[int, float]] = {}
+        for (material_id, quantity), cnt in quantity_by_material.items():
+            rank = (-cnt, quantity)
+            cur = best_qty_rank.get(material_id)
+            if cur is None or rank < cur:
+                best_qty_rank[material_id] = rank
+                materials[str(material_id)] = quantity
 
         return {
             "parent_name": parent_name,
@@ -3223,39 +3600,155 @@ def get_parent_inheritance_prefill(parent_name: str):
         conn.close()
 
 
+@lru_cache(maxsize=4)
+def _resolve_auto_material_ids(version: int) -> tuple[int | None, int | None]:
+    """
+    Strafor ve Boya+İşçilik hammadde id'lerini tek sorguyla çözer. Bu id'ler
+    fiilen sabittir; ürün/malzeme verisi değiştiğinde _product_data_version
+    üzerinden tazelenir, böylece her inherit çağrısında iki SELECT eksilir.
+    """
+    conn = get_db()
+    try:
+        rows = conn.execute(
+            "SELECT id, name FROM raw_materials "
+            "WHERE name LIKE '%Strafor%' OR name LIKE '%Boya%' ORDER BY id"
+        ).fetchall()
+    finally:
+        conn.close()
+
+    strafor_id = None
+    boya_id = None
+    for row in rows:
+        name = str(row["name"] or "")
+        if strafor_id is None and "Strafor" in name:
+            strafor_id = row["id"]
+        boya_pos = name.find("Boya")
+        if boya_id is None and boya_pos != -1 and "İşçilik" in name[boya_pos:]:
+            boya_id = row["id"]
+    return strafor_id, boya_id
+
+
+# inherit.apply flush SQL'leri modül kapsamında sabittir; her çağrıda yeniden
+# string kurulmaz ve sürücünün statement cache'i aynı nesneyi görür.
+_SQL_INHERIT_PRODUCT_UPDATE = """
+    UPDATE products AS p
+    SET kargo_kodu = v.kargo_kodu,
+        kargo_en = CAST(v.kargo_en AS real),
+        kargo_boy = CAST(v.kargo_boy AS real),
+        kargo_yukseklik = CAST(v.kargo_yukseklik AS real),
+        kargo_agirlik = CAST(v.kargo_agirlik AS real),
+        kargo_desi = CAST(v.kargo_desi AS real)
+    FROM (VALUES %s) AS v(kargo_kodu, kargo_en, kargo_boy, kargo_yukseklik, kargo_agirlik, kargo_desi, child_sku)
+    WHERE p.child_sku = v.child_sku
+"""
+
+_SQL_INHERIT_MATERIAL_UPSERT = """
+    INSERT INTO product_materials (child_sku, material_id, quantity)
+    VALUES %s
+    ON CONFLICT(child_sku, material_id) DO UPDATE SET quantity = EXCLUDED.quantity
+"""
+
+_SQL_INHERIT_COST_UPSERT = """
+    INSERT INTO product_costs (child_sku, cost_name, assigned)
+    VALUES %s
+    ON CONFLICT(child_sku, cost_name) DO UPDATE SET assigned = 1
+"""
+
+
 def _apply_parent_inheritance_core(
     conn,
     req: ParentInheritanceRequest,
-    kargo_lookup: dict[str, dict] | None = None,
+    kargo_lookup: dict[str, tuple] | None = None,
 ) -> dict:
     if kargo_lookup is None:
         kargo_lookup = load_kargo_lookup()
 
-    children = conn.execute(
+    # cost_map ya da weight_map boşsa her child aynı nedenle elenecek; tüm
+    # child kolonlarını çekip döngüye girmek yerine tek COUNT ile erken dönülür.
+    empty_map_reason = None
+    if not req.cost_map:
+        empty_map_reason = "no kargo mapping"
+    elif not req.weight_map:
+        empty_map_reason = "no weight mapping"
+    if empty_map_reason is not None:
+        count_row = conn.execute(
+            "SELECT COUNT(*) AS cnt FROM products WHERE parent_name = ? AND is_active = 1",
+            (req.parent_name,),
+        ).fetchone()
+        child_count = int(count_row["cnt"] or 0)
+        if not child_count:
+            raise HTTPException(status_code=404, detail="Bu parent altında ürün bulunamadı")
+        # Örnek satırlar gerçek child_sku'lardan kurulur; skipped_truncated
+        # ana yol ile aynı sözleşmeyi (count - len(sample)) korur.
+        detail_limit = max(0, int(os.getenv("INHERIT_RESPONSE_DETAIL_LIMIT", "250")))
+        skipped_sample: list[dict] = []
+        if detail_limit > 0:
+            sample_rows = conn.execute(
+                """
+                SELECT child_sku, variation_size
+                FROM products
+                WHERE parent_name = ? AND is_active = 1
+                LIMIT ?
+                """,
+                (req.parent_name, detail_limit),
+            ).fetchall()
+            skipped_sample = [
+                {
+                    "child_sku": row["child_sku"],
+                    "variation_size": row["variation_size"] or "(boyutsuz)",
+                    "reason": empty_map_reason,
+                }
+                for row in sample_rows
+            ]
+        return {
+            "status": "ok",
+            "parent": req.parent_name,
+            "cost_map": req.cost_map,
+            "kaplama_map": req.kaplama_map,
+            "kaplama_name_map": req.kaplama_name_map,
+            "allow_missing_kaplama": bool(req.allow_missing_kaplama),
+            "children_updated": 0,
+            "children_skipped": child_count,
+            "details": [],
+            "details_truncated": 0,
+            "skipped": skipped_sample,
+            "skipped_truncated": max(0, child_count - len(skipped_sample)),
+            "_metrics": {
+                "product_updates": 0,
+                "material_upserts": 0,
+                "cost_upserts": 0,
+            },
+        }
+
+    # Child satırları tek listede materialize edilmez; fetchmany partileriyle
+    # akar, işlenen satırlar bellekte tutulmaz.
+    children_cursor = conn.execute(
         """
         SELECT child_sku, child_name, alan_m2, variation_size, variation_color
         FROM products
         WHERE parent_name = ? AND is_active = 1
         """,
         (req.parent_name,)
-    ).fetchall()
-
-    if not children:
-        raise HTTPException(status_code=404, detail="Bu parent altında ürün bulunamadı")
-
-    strafor_row = conn.execute(
-        "SELECT id FROM raw_materials WHERE name LIKE '%Strafor%' LIMIT 1"
-    ).fetchone()
-    boya_row = conn.execute(
-        "SELECT id FROM raw_materials WHERE name LIKE '%Boya%İşçilik%' OR name LIKE '%Boya + İşçilik%' LIMIT 1"
-    ).fetchone()
+    )
 
-    strafor_id = strafor_row["id"] if strafor_row else None
-    boya_id = boya_row["id"] if boya_row else None
+    strafor_id, boya_id = _resolve_auto_material_ids(_product_data_version)
     sac_id = req.sac_material_id
     mdf_id = req.mdf_material_id
     auto_ids = {strafor_id, boya_id, sac_id, mdf_id} - {None}
 
+    # Otomatik malzeme reçetesi istek başına bir kez kurulur; child döngüsü
+    # dört ayrı None kontrolü yerine bu listeyi döner.
+    auto_recipe = [
+        (mat_id, multiplier, result_key)
+        for mat_id, multiplier, result_key in (
+            (strafor_id, 1.2, "strafor"),
+            (boya_id, 5.0, "boya_iscilik"),
+            (sac_id, 1.0, "sac"),
+            (mdf_id, 1.0, "mdf"),
+        )
+        if mat_id is not None
+    ]
+
     manual_material_assignments: list[tuple[int, float]] = []
     for mat_id_raw, quantity_raw in (req.materials or {}).items():
         try:
@@ -3268,90 +3761,198 @@ def _apply_parent_inheritance_core(
         manual_material_assignments.append((mat_id, quantity))
 
     inherit_detail_limit = max(0, int(os.getenv("INHERIT_RESPONSE_DETAIL_LIMIT", "250")))
+    flush_batch_rows = max(1000, int(os.getenv("INHERIT_FLUSH_BATCH_ROWS", "10000")))
+    children_seen = 0
     updated_children_count = 0
     skipped_children_count = 0
     updated_children_sample: list[dict] = []
     skipped_children_sample: list[dict] = []
     updated_child_skus: list[str] = []
     product_updates: list[tuple] = []
-    material_upserts: list[tuple] = []
+    # (sku, material_id) başına tek satır: son atanan miktar kazanır, aynı
+    # komutta çifte ON CONFLICT satırı oluşmaz.
+    material_upserts_map: dict[tuple[str, int], float] = {}
     cost_upserts: list[tuple] = []
 
-    kaplama_name_map_exact: dict[str, list[str]] = {}
-    kaplama_name_map_ci: dict[str, list[str]] = {}
-    for k, v in (req.kaplama_name_map or {}).items():
-        key = str(k).strip()
-        if not key:
-            continue
-        names = normalize_cost_name_list(v, canonicalize_kaplama=True)
-        if not names:
-            continue
-        kaplama_name_map_exact[key] = names
-        kaplama_name_map_ci[key.lower()] = names
-
-    kaplama_map_by_size: dict[str, list[str]] = {}
-    for k, v in (req.kaplama_map or {}).items():
-        key = str(k).strip()
-        if not key:
-            continue
-        names = normalize_cost_name_list(v, canonicalize_kaplama=True)
-        if not names:
-            continue
-        kaplama_map_by_size[key] = names
+    # Üç kaynak haritası tek geçişte normalize edilir; aynı isim listesi birden
+    # fazla anahtarda tekrarlandığında tuple cache'ten paylaşılır, her girişte
+    # yeni liste üretilmez.
+    kaplama_name_map_exact: dict[str, tuple[str, ...]] = {}
+    kaplama_name_map_ci: dict[str, tuple[str, ...]] = {}
+    kaplama_map_by_size: dict[str, tuple[str, ...]] = {}
+    kaplama_fallback_from_cost_map: dict[str, tuple[str, ...]] = {}
+    _name_tuple_cache: dict[tuple[str, ...], tuple[str, ...]] = {}
+    for source_kind, source_map in (
+        ("name", req.kaplama_name_map),
+        ("size", req.kaplama_map),
+        ("cost", req.cost_map),
+    ):
+        for k, v in (source_map or {}).items():
+            key = str(k).strip()
+            if not key:
+                continue
+            names = tuple(normalize_cost_name_list(v, canonicalize_kaplama=True))
+            if not names:
+                continue
+            names = _name_tuple_cache.setdefault(names, names)
+            if source_kind == "name":
+                kaplama_name_map_exact[key] = names
+                kaplama_name_map_ci[key.lower()] = names
+            elif source_kind == "size":
+                kaplama_map_by_size[key] = names
+            else:
+                kaplama_fallback_from_cost_map[key] = names
+
+    # Aynı maliyet adları binlerce child'da tekrarlanır; strip/casefold sonuçları
+    # istek boyunca cache'lenir ve intern'lenir ki her satırda yeni kısa ömürlü
+    # string üretilmesin.
+    cost_name_norm_cache: dict = {}
+    kaplama_resolution_cache: dict[tuple[str, str], tuple[str, ...]] = {}
+    # alan_m2 aynı boyuttaki tüm child'larda aynıdır; reçetedeki miktarlar
+    # benzersiz alan başına bir kez yuvarlanır.
+    area_qty_cache: dict[float, tuple[float, ...]] = {}
+
+    def normalize_assigned_cost(raw) -> tuple[str, str]:
+        cached = cost_name_norm_cache.get(raw)
+        if cached is None:
+            stripped = str(raw or "").strip()
+            if stripped:
+                stripped = sys.intern(stripped)
+            cached = (stripped, stripped.casefold())
+            cost_name_norm_cache[raw] = cached
+        return cached
 
-    kaplama_fallback_from_cost_map: dict[str, list[str]] = {}
-    for k, v in (req.cost_map or {}).items():
-        key = str(k).strip()
-        if not key:
-            continue
-        names = normalize_cost_name_list(v, canonicalize_kaplama=True)
-        if not names:
-            continue
-        kaplama_fallback_from_cost_map[key] = names
+    # Aynı boyuttaki tüm child'lar aynı kargo adı/ağırlık/desi çözümünü
+    # paylaşır; tam çözüm (ya da skip nedeni) boyut başına bir kez hesaplanır.
+    size_resolution_cache: dict[str, tuple] = {}
 
-    for child in children:
+    def resolve_size(size: str) -> tuple:
+        entry = size_resolution_cache.get(size)
+        if entry is not None:
+            return entry
+        kargo_cost_name = req.cost_map.get(size) or req.cost_map.get("*")
+        if not kargo_cost_name:
+            entry = (None, None, None, None, None, None, None, None)
+        else:
+            kargo_agirlik = req.weight_map.get(size)
+            if kargo_agirlik is None:
+                kargo_agirlik = req.weight_map.get("*")
+            weight_reason = None
+            if kargo_agirlik is None:
+                weight_reason = "no weight mapping"
+            else:
+                try:
+                    kargo_agirlik = float(kargo_agirlik)
+                except (TypeError, ValueError):
+                    weight_reason = "invalid weight"
+                else:
+                    if kargo_agirlik < 0:
+                        weight_reason = "negative weight"
+            if weight_reason is not None:
+                entry = (kargo_cost_name, weight_reason, None, None, None, None, None, None)
+            else:
+                kargo_kodu = normalize_kargo_code(kargo_cost_name)
+                kargo_dims = kargo_lookup.get(kargo_kodu) if kargo_kodu else None
+                kargo_en, kargo_boy, kargo_yukseklik = kargo_dims if kargo_dims else (None, None, None)
+                kargo_desi = calculate_kargo_desi(kargo_en, kargo_boy, kargo_yukseklik, kargo_agirlik)
+                entry = (
+                    kargo_cost_name,
+                    None,
+                    round(kargo_agirlik, 6),
+                    kargo_kodu,
+                    kargo_en,
+                    kargo_boy,
+                    kargo_yukseklik,
+                    kargo_desi,
+                )
+        size_resolution_cache[size] = entry
+        return entry
+
+    def record_skip(sku: str, size: str, reason: str):
+        nonlocal skipped_children_count
+        skipped_children_count += 1
+        if inherit_detail_limit > 0 and len(skipped_children_sample) < inherit_detail_limit:
+            skipped_children_sample.append({"child_sku": sku, "variation_size": size, "reason": reason})
+
+    flushed_product_updates = 0
+    flushed_material_upserts = 0
+    flushed_cost_upserts = 0
+
+    def flush_writes():
+        # Biriken yazımlar parti parti DB'ye gider; Python çalışma kümesi
+        # child sayısından bağımsız, flush eşiğiyle sınırlı kalır.
+        nonlocal flushed_product_updates, flushed_material_upserts, flushed_cost_upserts
+        if product_updates:
+            conn.execute_values(_SQL_INHERIT_PRODUCT_UPDATE, product_updates)
+            flushed_product_updates += len(product_updates)
+            product_updates.clear()
+        if material_upserts_map:
+            conn.execute_values(
+                _SQL_INHERIT_MATERIAL_UPSERT,
+                [(sku, mat_id, qty) for (sku, mat_id), qty in material_upserts_map.items()],
+            )
+            flushed_material_upserts += len(material_upserts_map)
+            material_upserts_map.clear()
+        if cost_upserts:
+            conn.execute_values(_SQL_INHERIT_COST_UPSERT, cost_upserts, template="(%s, %s, 1)")
+            flushed_cost_upserts += len(cost_upserts)
+            cost_upserts.clear()
+
+    for child in iter_rows(children_cursor, batch_size=2000):
+        children_seen += 1
         sku = child["child_sku"]
         child_name = (child["child_name"] or "").strip()
         variation_color = (child["variation_color"] or "").strip()
         alan = child["alan_m2"]
         size = child["variation_size"] or "(boyutsuz)"
 
-        kargo_cost_name = req.cost_map.get(size)
-        if not kargo_cost_name:
-            kargo_cost_name = req.cost_map.get("*")
+        (
+            kargo_cost_name,
+            weight_skip_reason,
+            rounded_agirlik,
+            kargo_kodu,
+            kargo_en,
+            kargo_boy,
+            kargo_yukseklik,
+            kargo_desi,
+        ) = resolve_size(size)
         if not kargo_cost_name:
-            skipped_children_count += 1
-            if inherit_detail_limit > 0 and len(skipped_children_sample) < inherit_detail_limit:
-                skipped_children_sample.append({"child_sku": sku, "variation_size": size, "reason": "no kargo mapping"})
+            record_skip(sku, size, "no kargo mapping")
             continue
 
-        kaplama_cost_names: list[str] = []
+        # Aynı (isim, renk) çifti çok sayıda boyutta tekrarlar; kaplama ismi
+        # çözümü istek içinde memoize edilir — N child yerine K benzersiz çift
+        # için lookup_keys kurulup harita taranır.
+        kaplama_cost_names: tuple[str, ...] = ()
         if child_name:
-            lookup_keys = []
-            tier_key = build_kaplama_group_key(
-                child_name,
-                detect_kaplama_tier(child_name, variation_color),
-            )
-            if tier_key:
-                lookup_keys.append(tier_key)
-            if variation_color:
-                lookup_keys.append(f"{child_name}||{variation_color}")
-            lookup_keys.append(child_name)
-
-            seen_keys = set()
-            for lookup_key in lookup_keys:
-                normalized_lookup = lookup_key.strip()
-                if not normalized_lookup:
-                    continue
-                lowered_lookup = normalized_lookup.lower()
-                if lowered_lookup in seen_keys:
-                    continue
-                seen_keys.add(lowered_lookup)
-                kaplama_cost_names = kaplama_name_map_exact.get(normalized_lookup, [])
-                if not kaplama_cost_names:
-                    kaplama_cost_names = kaplama_name_map_ci.get(lowered_lookup, [])
-                if kaplama_cost_names:
-                    break
+            resolution_key = (child_name, variation_color)
+            cached_names = kaplama_resolution_cache.get(resolution_key)
+            if cached_names is not None:
+                kaplama_cost_names = cached_names
+            else:
+                lookup_keys = []
+                tier_key = _kaplama_signature(child_name, variation_color)[1]
+                if tier_key:
+                    lookup_keys.append(tier_key)
+                if variation_color:
+                    lookup_keys.append(f"{child_name}||{variation_color}")
+                lookup_keys.append(child_name)
+
+                seen_keys = set()
+                for lookup_key in lookup_keys:
+                    normalized_lookup = lookup_key.strip()
+                    if not normalized_lookup:
+                        continue
+                    lowered_lookup = normalized_lookup.lower()
+                    if lowered_lookup in seen_keys:
+                        continue
+                    seen_keys.add(lowered_lookup)
+                    kaplama_cost_names = kaplama_name_map_exact.get(normalized_lookup, ())
+                    if not kaplama_cost_names:
+                        kaplama_cost_names = kaplama_name_map_ci.get(lowered_lookup, ())
+                    if kaplama_cost_names:
+                        break
+                kaplama_resolution_cache[resolution_key] = kaplama_cost_names
         if not kaplama_cost_names:
             if kaplama_map_by_size:
                 kaplama_source_map = kaplama_map_by_size
@@ -3359,45 +3960,18 @@ def _apply_parent_inheritance_core(
                 kaplama_source_map = {}
             else:
                 kaplama_source_map = kaplama_fallback_from_cost_map
-            kaplama_cost_names = kaplama_source_map.get(size, [])
+            kaplama_cost_names = kaplama_source_map.get(size, ())
             if not kaplama_cost_names:
-                kaplama_cost_names = kaplama_source_map.get("*", [])
+                kaplama_cost_names = kaplama_source_map.get("*", ())
         if not kaplama_cost_names:
             if not bool(req.allow_missing_kaplama):
-                skipped_children_count += 1
-                if inherit_detail_limit > 0 and len(skipped_children_sample) < inherit_detail_limit:
-                    skipped_children_sample.append({"child_sku": sku, "variation_size": size, "reason": "no kaplama mapping"})
+                record_skip(sku, size, "no kaplama mapping")
                 continue
 
-        kargo_agirlik = req.weight_map.get(size)
-        if kargo_agirlik is None:
-            kargo_agirlik = req.weight_map.get("*")
-        if kargo_agirlik is None:
-            skipped_children_count += 1
-            if inherit_detail_limit > 0 and len(skipped_children_sample) < inherit_detail_limit:
-                skipped_children_sample.append({"child_sku": sku, "variation_size": size, "reason": "no weight mapping"})
-            continue
-        try:
-            kargo_agirlik = float(kargo_agirlik)
-        except (TypeError, ValueError):
-            skipped_children_count += 1
-            if inherit_detail_limit > 0 and len(skipped_children_sample) < inherit_detail_limit:
-                skipped_children_sample.append({"child_sku": sku, "variation_size": size, "reason": "invalid weight"})
+        if weight_skip_reason is not None:
+            record_skip(sku, size, weight_skip_reason)
             continue
-        if kargo_agirlik < 0:
-            skipped_children_count += 1
-            if inherit_detail_limit > 0 and len(skipped_children_sample) < inherit_detail_limit:
-                skipped_children_sample.append({"child_sku": sku, "variation_size": size, "reason": "negative weight"})
-            continue
-
-        kargo_kodu = normalize_kargo_code(kargo_cost_name)
-        kargo_meta = kargo_lookup.get(kargo_kodu) if kargo_kodu else None
-        kargo_en = kargo_meta["kargo_en"] if kargo_meta else None
-        kargo_boy = kargo_meta["kargo_boy"] if kargo_meta else None
-        kargo_yukseklik = kargo_meta["kargo_yukseklik"] if kargo_meta else None
-        kargo_desi = calculate_kargo_desi(kargo_en, kargo_boy, kargo_yukseklik, kargo_agirlik)
 
-        rounded_agirlik = round(kargo_agirlik, 6)
         product_updates.append((
             kargo_kodu,
             kargo_en,
@@ -3409,15 +3983,14 @@ def _apply_parent_inheritance_core(
         ))
 
         for mat_id, quantity in manual_material_assignments:
-            material_upserts.append((sku, mat_id, quantity, quantity))
+            material_upserts_map[(sku, mat_id)] = quantity
 
         assigned_costs = [kargo_cost_name, *kaplama_cost_names]
         seen_assigned: set[str] = set()
         for assigned_cost in assigned_costs:
-            assigned_cost = str(assigned_cost or "").strip()
+            assigned_cost, key = normalize_assigned_cost(assigned_cost)
             if not assigned_cost:
                 continue
-            key = assigned_cost.casefold()
             if key in seen_assigned:
                 continue
             seen_assigned.add(key)
@@ -3439,66 +4012,27 @@ def _apply_parent_inheritance_core(
             "strafor": None, "boya_iscilik": None, "sac": None, "mdf": None,
         }
 
-        if alan is not None:
-            if strafor_id is not None:
-                strafor_qty = round(alan * 1.2, 6)
-                material_upserts.append((sku, strafor_id, strafor_qty, strafor_qty))
-                child_result["strafor"] = strafor_qty
-
-            if boya_id is not None:
-                boya_qty = round(alan * 5, 6)
-                material_upserts.append((sku, boya_id, boya_qty, boya_qty))
-                child_result["boya_iscilik"] = boya_qty
-
-            if sac_id is not None:
-                sac_qty = round(alan, 6)
-                material_upserts.append((sku, sac_id, sac_qty, sac_qty))
-                child_result["sac"] = sac_qty
-
-            if mdf_id is not None:
-                mdf_qty = round(alan, 6)
-                material_upserts.append((sku, mdf_id, mdf_qty, mdf_qty))
-                child_result["mdf"] = mdf_qty
+        if alan is not None and auto_recipe:
+            quantities = area_qty_cache.get(alan)
+            if quantities is None:
+                quantities = tuple(round(alan * multiplier, 6) for _, multiplier, _ in auto_recipe)
+                area_qty_cache[alan] = quantities
+            for (mat_id, _, result_key), qty in zip(auto_recipe, quantities):
+                material_upserts_map[(sku, mat_id)] = qty
+                child_result[result_key] = qty
 
         updated_children_count += 1
         updated_child_skus.append(sku)
         if inherit_detail_limit > 0 and len(updated_children_sample) < inherit_detail_limit:
             updated_children_sample.append(child_result)
 
-    if product_updates:
-        conn.executemany(
-            """
-            UPDATE products
-            SET kargo_kodu = ?,
-                kargo_en = ?,
-                kargo_boy = ?,
-                kargo_yukseklik = ?,
-                kargo_agirlik = ?,
-                kargo_desi = ?
-            WHERE child_sku = ?
-            """,
-            product_updates,
-        )
+        if len(product_updates) >= flush_batch_rows:
+            flush_writes()
 
-    if material_upserts:
-        conn.executemany(
-            """
-            INSERT INTO product_materials (child_sku, material_id, quantity)
-            VALUES (?, ?, ?)
-            ON CONFLICT(child_sku, material_id) DO UPDATE SET quantity = ?
-            """,
-            material_upserts,
-        )
+    if not children_seen:
+        raise HTTPException(status_code=404, detail="Bu parent altında ürün bulunamadı")
 
-    if cost_upserts:
-        conn.executemany(
-            """
-            INSERT INTO product_costs (child_sku, cost_name, assigned)
-            VALUES (?, ?, 1)
-            ON CONFLICT(child_sku, cost_name) DO UPDATE SET assigned = 1
-            """,
-            cost_upserts,
-        )
+    flush_writes()
 
     if updated_child_skus:
         set_products_raw_cost_status(conn, updated_child_skus, RAW_COST_STATUS_DONE)
@@ -3517,9 +4051,9 @@ def _apply_parent_inheritance_core(
         "skipped": skipped_children_sample,
         "skipped_truncated": max(0, skipped_children_count - len(skipped_children_sample)),
         "_metrics": {
-            "product_updates": len(product_updates),
-            "material_upserts": len(material_upserts),
-            "cost_upserts": len(cost_upserts),
+            "product_updates": flushed_product_updates,
+            "material_upserts": flushed_material_upserts,
+            "cost_upserts": flushed_cost_upserts,
         },
     }
 
@@ -3544,35 +4078,39 @@ def apply_parent_inheritance(req: ParentInheritanceRequest, request: Request):
     approval_id = req.approval_id
     approval_context = req.model_dump(mode="json", exclude={"approval_id"})
 
-    if ENABLE_APPROVAL_WORKFLOW and user.get("role") != "admin":
-        if not approval_id:
-            created_approval_id = create_approval_request(
-                "inherit.apply",
-                req.parent_name,
-                approval_context,
-                user,
-            )
-            write_audit_log(
-                user,
-                "approval.requested",
-                target=req.parent_name,
-                details={
-                    "approval_id": created_approval_id,
-                    "request_type": "inherit.apply",
-                    "parent_name": req.parent_name,
-                },
-                status="pending",
-            )
-            return {
-                "status": "pending_approval",
+    needs_approval_check = ENABLE_APPROVAL_WORKFLOW and user.get("role") != "admin"
+    if needs_approval_check and not approval_id:
+        created_approval_id = create_approval_request(
+            "inherit.apply",
+            req.parent_name,
+            approval_context,
+            user,
+        )
+        write_audit_log(
+            user,
+            "approval.requested",
+            target=req.parent_name,
+            details={
                 "approval_id": created_approval_id,
+                "request_type": "inherit.apply",
                 "parent_name": req.parent_name,
-                "message": "İşlem onaya gönderildi. Admin onayından sonra approval_id ile tekrar çalıştırın.",
-            }
+            },
+            status="pending",
+        )
+        return {
+            "status": "pending_approval",
+            "approval_id": created_approval_id,
+            "parent_name": req.parent_name,
+            "message": "İşlem onaya gönderildi. Admin onayından sonra approval_id ile tekrar çalıştırın.",
+        }
 
-        approval_conn = get_db()
-        try:
-            approval_row = approval_conn.execute(
+    conn = get_db()
+    try:
+        if needs_approval_check:
+            # Onay kaydı ayrı bir bağlantı yerine ana bağlantıda, mutasyonlarla
+            # aynı transaction içinde okunur: bir get_db() turu eksilir ve iki
+            # bağlantı arasında status değişme (TOCTOU) aralığı kalmaz.
+            approval_row = conn.execute(
                 """
                 SELECT id, request_type, status, payload, requested_by
                 FROM approval_requests
@@ -3580,33 +4118,51 @@ def apply_parent_inheritance(req: ParentInheritanceRequest, request: Request):
                 """,
                 (approval_id,),
             ).fetchone()
-        finally:
-            approval_conn.close()
-        if not approval_row:
-            raise HTTPException(status_code=404, detail="Onay kaydı bulunamadı")
-        if str(approval_row["request_type"] or "").strip() != "inherit.apply":
-            raise HTTPException(status_code=400, detail="approval_id bu işlem tipiyle uyumlu değil")
-        if str(approval_row["status"] or "").strip().lower() != "approved":
-            raise HTTPException(status_code=409, detail="İşlem henüz onaylanmamış")
-        if approval_row["requested_by"] and int(approval_row["requested_by"]) != int(user["id"]):
-            raise HTTPException(status_code=403, detail="Bu onay kaydı başka kullanıcıya ait")
-
-        approved_payload = parse_json_text(approval_row["payload"]) or {}
-        if approved_payload != approval_context:
-            raise HTTPException(status_code=400, detail="Onay sonrası payload değişmiş. Yeniden onay isteği açın.")
+            if not approval_row:
+                raise HTTPException(status_code=404, detail="Onay kaydı bulunamadı")
+            if str(approval_row["request_type"] or "").strip() != "inherit.apply":
+                raise HTTPException(status_code=400, detail="approval_id bu işlem tipiyle uyumlu değil")
+            if str(approval_row["status"] or "").strip().lower() != "approved":
+                raise HTTPException(status_code=409, detail="İşlem henüz onaylanmamış")
+            if approval_row["requested_by"] and int(approval_row["requested_by"]) != int(user["id"]):
+                raise HTTPException(status_code=403, detail="Bu onay kaydı başka kullanıcıya ait")
+
+            approved_payload = parse_json_text(approval_row["payload"]) or {}
+            if approved_payload != approval_context:
+                raise HTTPException(status_code=400, detail="Onay sonrası payload değişmiş. Yeniden onay isteği açın.")
 
-    conn = get_db()
-    try:
         core_result = _apply_parent_inheritance_core(conn, req)
+        if approval_id:
+            # Yürütme sonucu ayrı bir get_db() + commit yerine ana transaction
+            # içinde yazılır; çağrı başına bir bağlantı turu eksilir.
+            conn.execute(
+                """
+                UPDATE approval_requests
+                SET executed_at = CURRENT_TIMESTAMP,
+                    execution_result = ?
+                WHERE id = ?
+                """,
+                (
+                    json_dumps_compact(
+                        {
+                            "children_updated": int(core_result.get("children_updated") or 0),
+                            "children_skipped": int(core_result.get("children_skipped") or 0),
+                            "parent_name": req.parent_name,
+                        }
+                    ),
+                    approval_id,
+                ),
+            )
         conn.commit()
     except Exception:
         try:
             conn.rollback()
         except Exception:
             pass
-        conn.close()
         raise
-    conn.close()
+    finally:
+        conn.close()
+    invalidate_product_groups_cache()
 
     metrics = core_result.pop("_metrics", {}) if isinstance(core_result, dict) else {}
     updated_children_count = int(core_result.get("children_updated") or 0)
@@ -3643,33 +4199,6 @@ def apply_parent_inheritance(req: ParentInheritanceRequest, request: Request):
         },
     )
 
-    if approval_id:
-        try:
-            conn2 = get_db()
-            conn2.execute(
-                """
-                UPDATE approval_requests
-                SET executed_at = CURRENT_TIMESTAMP,
-                    execution_result = ?
-                WHERE id = ?
-                """,
-                (
-                    json.dumps(
-                        {
-                            "children_updated": updated_children_count,
-                            "children_skipped": skipped_children_count,
-                            "parent_name": req.parent_name,
-                        },
-                        ensure_ascii=False,
-                    ),
-                    approval_id,
-                ),
-            )
-            conn2.commit()
-            conn2.close()
-        except Exception:
-            pass
-
     return core_result
 
 
@@ -3803,6 +4332,7 @@ def apply_parent_cost_group_inheritance_atomic(
     finally:
         conn.close()
 
+    invalidate_product_groups_cache()
     selected_parent_result = selected_parent_result or fallback_parent_result
     elapsed_ms = int((time.perf_counter() - started_at) * 1000)
     logger.info(
@@ -3854,7 +4384,6 @@ def export_excel(payload: ExportRequest, request: Request):
     started_at = time.perf_counter()
     user = require_request_user(request)
     conn = get_db()
-    query_chunk_size = max(100, int(os.getenv("EXPORT_QUERY_CHUNK_SIZE", "500")))
     requested_skus: list[str] = []
     seen_skus: set[str] = set()
     for raw_sku in payload.child_skus:
@@ -3873,89 +4402,95 @@ def export_excel(payload: ExportRequest, request: Request):
     costs_by_sku: dict[str, dict[str, str]] = defaultdict(dict)
 
     try:
-        # Ürünleri toplu çek (N+1 yerine chunked IN sorguları)
-        for sku_chunk in chunk_list(requested_skus, query_chunk_size):
-            placeholders = ", ".join(["?"] * len(sku_chunk))
+        # SKU listesi bir kez temp tabloya yazılır; üç sorgu da dinamik IN
+        # listeleri yerine bu tabloya JOIN yapar. Böylece chunk başına yeniden
+        # parse edilen değişken placeholder'lı sorgular tamamen kalkar.
+        conn.execute("CREATE TEMP TABLE _export_skus (sku TEXT PRIMARY KEY) ON COMMIT DROP")
+        conn.executemany(
+            "INSERT INTO _export_skus (sku) VALUES (?) ON CONFLICT DO NOTHING",
+            [(sku,) for sku in requested_skus],
+        )
+
+        rows = conn.execute(
+            """
+            SELECT p.child_sku, p.child_name, p.variation_color, p.en, p.boy,
+                   p.kargo_en, p.kargo_boy, p.kargo_yukseklik, p.kargo_agirlik, p.kargo_desi
+            FROM products p
+            JOIN _export_skus s ON s.sku = p.child_sku
+            WHERE p.is_active = 1
+            """
+        ).fetchall()
+        for row in rows:
+            products_by_sku[row["child_sku"]] = row
+
+        # Aktif/eksik SKU eleme işini JOIN'ler sunucu tarafında yapıyor;
+        # Python tarafında ayrıca found_skus listesi kurulmaz.
+        if payload.include_materials and products_by_sku:
             rows = conn.execute(
-                f"""
-                SELECT child_sku, child_name, variation_color, en, boy,
-                       kargo_en, kargo_boy, kargo_yukseklik, kargo_agirlik, kargo_desi
-                FROM products
-                WHERE is_active = 1
-                  AND child_sku IN ({placeholders})
-                """,
-                sku_chunk,
+                """
+                SELECT pm.child_sku, rm.name, pm.quantity
+                FROM product_materials pm
+                JOIN _export_skus s ON s.sku = pm.child_sku
+                JOIN products p ON p.child_sku = pm.child_sku AND p.is_active = 1
+                JOIN raw_materials rm ON pm.material_id = rm.id
+                """
+            ).fetchall()
+            for row in rows:
+                materials_by_sku[row["child_sku"]][row["name"]] = row["quantity"]
+
+        if payload.include_costs and products_by_sku:
+            rows = conn.execute(
+                """
+                SELECT pc.child_sku, pc.cost_name
+                FROM product_costs pc
+                JOIN _export_skus s ON s.sku = pc.child_sku
+                JOIN products p ON p.child_sku = pc.child_sku AND p.is_active = 1
+                WHERE pc.assigned = 1
+                """
             ).fetchall()
             for row in rows:
-                product = dict(row)
-                products_by_sku[product["child_sku"]] = product
-
-        found_skus = [sku for sku in requested_skus if sku in products_by_sku]
-
-        if payload.include_materials and found_skus:
-            for sku_chunk in chunk_list(found_skus, query_chunk_size):
-                placeholders = ", ".join(["?"] * len(sku_chunk))
-                rows = conn.execute(
-                    f"""
-                    SELECT pm.child_sku, rm.name, pm.quantity
-                    FROM product_materials pm
-                    JOIN raw_materials rm ON pm.material_id = rm.id
-                    WHERE pm.child_sku IN ({placeholders})
-                    """,
-                    sku_chunk,
-                ).fetchall()
-                for row in rows:
-                    mat = dict(row)
-                    materials_by_sku[mat["child_sku"]][mat["name"]] = mat["quantity"]
-
-        if payload.include_costs and found_skus:
-            for sku_chunk in chunk_list(found_skus, query_chunk_size):
-                placeholders = ", ".join(["?"] * len(sku_chunk))
-                rows = conn.execute(
-                    f"""
-                    SELECT child_sku, cost_name
-                    FROM product_costs
-                    WHERE assigned = 1
-                      AND child_sku IN ({placeholders})
-                    """,
-                    sku_chunk,
-                ).fetchall()
-                for row in rows:
-                    cost = dict(row)
-                    costs_by_sku[cost["child_sku"]][cost["cost_name"]] = "x"
+                costs_by_sku[row["child_sku"]][row["cost_name"]] = "x"
     finally:
+        # Rollback transaction'ı kapatır ve ON COMMIT DROP temp tabloyu düşürür.
+        try:
+            conn.rollback()
+        except Exception:
+            pass
         conn.close()
 
-    products_data: list[dict] = []
-    for sku in requested_skus:
-        p_dict = products_by_sku.get(sku)
-        if not p_dict:
-            continue
-        export_item = {
-            "child_sku": p_dict["child_sku"],
-            "child_name": p_dict["child_name"],
-            "variation_color": p_dict.get("variation_color"),
-            "en": p_dict["kargo_en"] if p_dict.get("kargo_en") is not None else p_dict["en"],
-            "boy": p_dict["kargo_boy"] if p_dict.get("kargo_boy") is not None else p_dict["boy"],
-            "yukseklik": p_dict.get("kargo_yukseklik"),
-            "agirlik": p_dict.get("kargo_agirlik"),
-            "desi": p_dict.get("kargo_desi"),
-        }
-        if payload.include_materials:
-            export_item["materials"] = materials_by_sku.get(sku, {})
-        if payload.include_costs:
-            export_item["costs"] = costs_by_sku.get(sku, {})
-        products_data.append(export_item)
-
-    if not products_data:
+    if not products_by_sku:
         raise HTTPException(status_code=400, detail="Export edilecek ürün bulunamadı")
 
-    output_path = export_to_template(products_data)
+    # Export öğeleri topluca liste yapılmadan generator olarak akıtılır;
+    # write_only writer satır satır tüketir, peak bellek tek satır olur.
+    def iter_export_items():
+        for sku in requested_skus:
+            p_dict = products_by_sku.get(sku)
+            if not p_dict:
+                continue
+            export_item = {
+                "child_sku": p_dict["child_sku"],
+                "child_name": p_dict["child_name"],
+                "variation_color": p_dict.get("variation_color"),
+                "en": p_dict["kargo_en"] if p_dict.get("kargo_en") is not None else p_dict["en"],
+                "boy": p_dict["kargo_boy"] if p_dict.get("kargo_boy") is not None else p_dict["boy"],
+                "yukseklik": p_dict.get("kargo_yukseklik"),
+                "agirlik": p_dict.get("kargo_agirlik"),
+                "desi": p_dict.get("kargo_desi"),
+            }
+            if payload.include_materials:
+                export_item["materials"] = materials_by_sku.get(sku, {})
+            if payload.include_costs:
+                export_item["costs"] = costs_by_sku.get(sku, {})
+            yield export_item
+
+    exported_count = len(products_by_sku)
+    output_path = export_to_template(iter_export_items())
     elapsed_ms = int((time.perf_counter() - started_at) * 1000)
     logger.info(
         "[export] requested=%s exported=%s include_materials=%s include_costs=%s duration_ms=%s",
         len(requested_skus),
-        len(products_data),
+        exported_count,
         bool(payload.include_materials),
         bool(payload.include_costs),
         elapsed_ms,
@@ -3963,10 +4498,10 @@ def export_excel(payload: ExportRequest, request: Request):
     write_audit_log(
         user,
         "export.run",
-        target=f"{len(products_data)} ürün",
+        target=f"{exported_count} ürün",
         details={
             "requested_skus": len(requested_skus),
-            "exported_skus": len(products_data),
+            "exported_skus": exported_count,
             "include_materials": bool(payload.include_materials),
             "include_costs": bool(payload.include_costs),
             "duration_ms": elapsed_ms,
@@ -16,9 +16,9 @@ from pathlib import Path
 from database import adapt_sql_for_backend, get_db, init_db
 
 try:
-    from psycopg2.extras import execute_batch
+    from psycopg2.extras import execute_values
 except Exception:
-    execute_batch = None
+    execute_values = None
 
 
 TABLES_IN_ORDER = [
@@ -63,6 +63,7 @@ def migrate(sqlite_path: Path):
     total = 0
     batch_size = max(100, int(os.getenv("MIGRATION_BATCH_SIZE", "1000")))
     print(f"Batch size: {batch_size}")
+    tables_with_id: list[str] = []
     for table in TABLES_IN_ORDER:
         rows = load_sqlite_rows(sqlite_conn, table)
         if not rows:
@@ -71,9 +72,6 @@ def migrate(sqlite_path: Path):
 
         cols = list(rows[0].keys())
         col_sql = ", ".join(cols)
-        placeholders = ", ".join(["?"] * len(cols))
-        insert_sql = f"INSERT INTO {table} ({col_sql}) VALUES ({placeholders})"
-        insert_sql = adapt_sql_for_backend(insert_sql)
         values = [tuple(row.get(c) for c in cols) for row in rows]
         table_total = len(values)
         inserted = 0
@@ -81,9 +79,20 @@ def migrate(sqlite_path: Path):
         raw_cursor = getattr(cursor, "_inner", cursor)
 
         for chunk in batched(values, batch_size):
-            if execute_batch is not None:
-                execute_batch(raw_cursor, insert_sql, chunk, page_size=len(chunk))
+            if execute_values is not None:
+                # Parti başına tek çok satırlı INSERT: satır başına round-trip yerine
+                # parse/plan maliyeti parti genelinde amorti edilir.
+                execute_values(
+                    raw_cursor,
+                    f"INSERT INTO {table} ({col_sql}) VALUES %s",
+                    chunk,
+                    page_size=len(chunk),
+                )
             else:
+                placeholders = ", ".join(["?"] * len(cols))
+                insert_sql = adapt_sql_for_backend(
+                    f"INSERT INTO {table} ({col_sql}) VALUES ({placeholders})"
+                )
                 raw_cursor.executemany(insert_sql, chunk)
 
             inserted += len(chunk)
@@ -91,22 +100,25 @@ def migrate(sqlite_path: Path):
             if inserted == table_total or inserted % batch_size == 0:
                 print(f"  {table}: {inserted}/{table_total}")
 
-        # id sequence'leri MAX(id)'ye çek
         if "id" in cols:
-            pg.execute(
-                """
-                SELECT setval(
-                    pg_get_serial_sequence(?, 'id'),
-                    COALESCE((SELECT MAX(id) FROM """ + table + """), 1),
-                    (SELECT COUNT(*) > 0 FROM """ + table + """)
-                )
-                """,
-                (table,),
-            )
-
-        pg.commit()
+            tables_with_id.append(table)
         print(f"- {table}: {table_total} satır")
 
+    # id sequence'leri en sonda, tüm tablolar yüklendikten sonra MAX(id)'ye çekilir;
+    # taşımanın tamamı tek transaction'da gider (hata halinde hedef yarım kalmaz).
+    for table in tables_with_id:
+        pg.execute(
+            """
+            SELECT setval(
+                pg_get_serial_sequence(?, 'id'),
+                COALESCE((SELECT MAX(id) FROM """ + table + """), 1),
+                (SELECT COUNT(*) > 0 FROM """ + table + """)
+            )
+            """,
+            (table,),
+        )
+
+    pg.commit()
     pg.close()
     sqlite_conn.close()
     print(f"✅ Migration tamamlandı. Toplam {total} satır taşındı.")
@@ -2,12 +2,30 @@
 Maliyet Sistemi - Pydantic Modelleri
 """
 
-from pydantic import BaseModel, Field
+from enum import StrEnum
+
+from pydantic import BaseModel, ConfigDict, Field, field_validator
 from typing import Optional, Literal, Any
 from datetime import datetime
 
 
+class CostCategory(StrEnum):
+    """Maliyet kategorisi seçenekleri; str alt sınıfı olduğundan mevcut
+    string karşılaştırmaları ve SQL parametreleri aynen çalışır."""
+    KARGO = "kargo"
+    KAPLAMA = "kaplama"
+
+
+class UserRole(StrEnum):
+    ADMIN = "admin"
+    USER = "user"
+
+
 class ProductResponse(BaseModel):
+    # Salt-okunur response DTO'su: frozen __setattr__ doğrulamasını kaldırır,
+    # extra="ignore" DB satırındaki fazla kolonları maliyetsizce eler.
+    model_config = ConfigDict(extra="ignore", frozen=True)
+
     id: int
     kategori: str
     parent_id: Optional[float] = None
@@ -32,6 +50,8 @@ class ProductResponse(BaseModel):
 
 
 class RawMaterialResponse(BaseModel):
+    model_config = ConfigDict(extra="ignore", frozen=True)
+
     id: int
     name: str
     unit: str
@@ -76,14 +96,14 @@ class ProductRawCostStatusUpdate(BaseModel):
 
 class CostDefinitionCreate(BaseModel):
     name: str
-    category: Literal["kargo", "kaplama"] = "kaplama"
+    category: CostCategory = CostCategory.KAPLAMA
     kargo_code: Optional[str] = None
     is_active: bool = True
 
 
 class CostDefinitionUpdate(BaseModel):
     name: Optional[str] = None
-    category: Optional[Literal["kargo", "kaplama"]] = None
+    category: Optional[CostCategory] = None
     kargo_code: Optional[str] = None
     is_active: Optional[bool] = None
 
@@ -108,6 +128,13 @@ class ParentInheritanceRequest(BaseModel):
     mdf_material_id: Optional[int] = None  # Seçilen MDF (id), miktar = Alan
     approval_id: Optional[int] = None  # Onay workflow aktifken approved isteği execute etmek için
 
+    @field_validator("kaplama_map", "kaplama_name_map", mode="before")
+    @classmethod
+    def _empty_map_fast_path(cls, v):
+        # İsteklerin çoğunda kaplama haritaları boş/null gelir; union üyeli
+        # dict validator'ına girmeden boş dict'e kısa devre yapılır.
+        return v or {}
+
 
 class ProductSyncRequest(BaseModel):
     categories: list[str] = Field(default_factory=list)  # boş ise tüm kategoriler
@@ -132,17 +159,19 @@ class AuthChangePasswordRequest(BaseModel):
 class AuthUserCreate(BaseModel):
     username: str
     password: str
-    role: Literal["admin", "user"] = "user"
+    role: UserRole = UserRole.USER
     is_active: bool = True
 
 
 class AuthUserUpdate(BaseModel):
     password: Optional[str] = None
-    role: Optional[Literal["admin", "user"]] = None
+    role: Optional[UserRole] = None
     is_active: Optional[bool] = None
 
 
 class ParentSearchItem(BaseModel):
+    model_config = ConfigDict(extra="ignore", frozen=True)
+
     parent_id: float
     parent_name: str
     parent_sku: Optional[str] = None
@@ -187,8 +216,15 @@ class ParentCostGroupInheritanceApplyRequest(BaseModel):
     mdf_material_id: Optional[int] = None
     selected_parent_name: Optional[str] = None
 
+    @field_validator("kaplama_map", "kaplama_name_map", mode="before")
+    @classmethod
+    def _empty_map_fast_path(cls, v):
+        return v or {}
+
 
 class StatsResponse(BaseModel):
+    model_config = ConfigDict(extra="ignore", frozen=True)
+
     total_products: int
     metal_products: int
     ahsap_products: int
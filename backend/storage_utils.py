@@ -6,56 +6,254 @@ Vercel gibi ortamlarda /tmp üstüne cache alır.
 from __future__ import annotations
 
 import hashlib
+import json
 import os
+import shutil
+import tempfile
+import threading
 import time
+import urllib.error
 import urllib.request
+from collections import OrderedDict
+from functools import lru_cache
 from pathlib import Path
 
+# Sıcak TTL kontrolleri için süreç içi LRU: doğrulanmış (url, cache_name)
+# çiftleri TTL penceresi boyunca stat syscall'ı bile olmadan döner.
+_MEM_CACHE_MAX_ENTRIES = 256
+_mem_cache: OrderedDict[tuple[str, str], tuple[Path, float]] = OrderedDict()
+_mem_cache_lock = threading.Lock()
+
+
+def _mem_cache_store(key: tuple[str, str], path: Path) -> None:
+    with _mem_cache_lock:
+        _mem_cache[key] = (path, time.time())
+        _mem_cache.move_to_end(key)
+        while len(_mem_cache) > _MEM_CACHE_MAX_ENTRIES:
+            _mem_cache.popitem(last=False)
+
+# requests varsa bağlantı havuzlu Session kullanılır: aynı hosttan art arda
+# indirmelerde TCP+TLS el sıkışması tekrarlanmaz. Yoksa urllib'e düşülür.
+try:
+    import requests as _requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+except Exception:
+    _requests = None
+
+if _requests is not None:
+    _http_session = _requests.Session()
+    _http_adapter = HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=16,
+        max_retries=Retry(total=2, backoff_factor=0.2),
+    )
+    _http_session.mount("https://", _http_adapter)
+    _http_session.mount("http://", _http_adapter)
+else:
+    _http_session = None
+
+
+def _download_to(raw_url: str, tmp_target: Path, headers: dict | None = None) -> tuple[int | None, dict]:
+    """
+    URL gövdesini tmp_target'a akıtır.
+    Dönen değer: (yazılan byte sayısı, yanıt validator'ları).
+    HTTP 304 (içerik değişmemiş) durumunda (None, {}) döner.
+    """
+    if _http_session is not None:
+        with _http_session.get(raw_url, timeout=15, stream=True, headers=headers or None) as resp:
+            if resp.status_code == 304:
+                return None, {}
+            resp.raise_for_status()
+            with open(tmp_target, "wb") as fh:
+                for chunk in resp.iter_content(chunk_size=1024 * 1024):
+                    fh.write(chunk)
+                written = fh.tell()
+            return written, {
+                "etag": resp.headers.get("ETag"),
+                "last_modified": resp.headers.get("Last-Modified"),
+            }
+    request = urllib.request.Request(raw_url, headers=headers or {})
+    try:
+        with urllib.request.urlopen(request, timeout=15) as resp:
+            with open(tmp_target, "wb") as fh:
+                shutil.copyfileobj(resp, fh, length=1024 * 1024)
+                written = fh.tell()
+            return written, {
+                "etag": resp.headers.get("ETag"),
+                "last_modified": resp.headers.get("Last-Modified"),
+            }
+    except urllib.error.HTTPError as exc:
+        if exc.code == 304:
+            return None, {}
+        raise
+
 
 def is_http_url(value: str | None) -> bool:
-    raw = str(value or "").strip().lower()
-    return raw.startswith("http://") or raw.startswith("https://")
+    if not isinstance(value, str):
+        if value is None:
+            return False
+        value = str(value)
+    # Tüm string'i lower()'lamak yerine yalnızca şemayı kapsayan ilk 8
+    # karakterlik dilim normalize edilir; uzun URL'lerde kopya maliyeti düşer.
+    return value.strip()[:8].lower().startswith(("http://", "https://"))
+
+
+# İzin verilmeyen karakterleri silen çeviri tablosu; str.translate tek C
+# döngüsünde çalışır, karakter başına Python dispatch'i olmaz. (Latin-1
+# aralığını kapsar; cache adları pratikte ASCII'dir.)
+_SAFE_NAME_TABLE = {
+    code: None
+    for code in range(256)
+    if not (chr(code).isalnum() or chr(code) in "._-")
+}
+
+
+@lru_cache(maxsize=1024)
+def _cache_key(url: str, cache_name: str) -> str:
+    """(url, cache_name) çifti için dosya adını üretir; saf fonksiyon, memoize."""
+    key = hashlib.blake2b(url.encode("utf-8"), digest_size=6).hexdigest()
+    safe_name = cache_name.translate(_SAFE_NAME_TABLE) or "file.bin"
+    return f"{key}_{safe_name}"
+
+
+# Cache kökü ortamdan bir kez çözülür; her çağrıda getenv + Path kurulumu
+# + expanduser tekrarlanmaz.
+_CACHE_ROOT = Path(os.getenv("REMOTE_FILE_CACHE_DIR", "/tmp/maliyet_cache")).expanduser()
+try:
+    _CACHE_ROOT.mkdir(parents=True, exist_ok=True)
+except Exception:
+    pass
 
 
 def _resolve_cache_target(url: str, cache_name: str) -> Path:
-    cache_root = Path(os.getenv("REMOTE_FILE_CACHE_DIR", "/tmp/maliyet_cache")).expanduser()
-    cache_root.mkdir(parents=True, exist_ok=True)
-    key = hashlib.sha1(str(url or "").strip().encode("utf-8")).hexdigest()[:12]
-    safe_name = "".join(ch for ch in str(cache_name or "file.bin") if ch.isalnum() or ch in "._-") or "file.bin"
-    return cache_root / f"{key}_{safe_name}"
+    if not _CACHE_ROOT.is_dir():
+        # Serverless'ta /tmp silinebilir; klasör idempotent şekilde yeniden kurulur.
+        _CACHE_ROOT.mkdir(parents=True, exist_ok=True)
+    return _CACHE_ROOT / _cache_key(str(url or "").strip(), str(cache_name or "file.bin"))
 
 
 def cache_remote_file(url: str, cache_name: str, ttl_seconds: int = 900) -> Path | None:
     """
     URL'den dosyayı indirip /tmp/maliyet_cache altında cacheler.
-    TTL dolmadıysa mevcut cache'i döndürür.
+    TTL dolmadıysa mevcut cache'i döndürür. TTL dolduğunda ETag/Last-Modified
+    sidecar'ı varsa conditional GET atılır; 304 dönerse gövde indirilmeden
+    mtime tazelenip mevcut cache kullanılır.
     """
     raw_url = str(url or "").strip()
     if not is_http_url(raw_url):
         return None
 
+    ttl = max(int(ttl_seconds), 0)
+    now = time.time()
+    mem_key = (raw_url, str(cache_name or ""))
+    with _mem_cache_lock:
+        mem_entry = _mem_cache.get(mem_key)
+        if mem_entry is not None:
+            if now - mem_entry[1] <= ttl:
+                _mem_cache.move_to_end(mem_key)
+                return mem_entry[0]
+            del _mem_cache[mem_key]
+
     target = _resolve_cache_target(raw_url, cache_name)
+    meta_path = target.with_suffix(target.suffix + ".meta")
 
-    now = time.time()
-    if target.exists() and (now - target.stat().st_mtime) <= max(int(ttl_seconds), 0):
+    # Tek os.stat hem varlık hem mtime verir; en sık yol olan cache hit'te
+    # exists() + stat() ikilisinin çift syscall'ı tek'e iner.
+    try:
+        cache_stat = os.stat(target)
+    except OSError:
+        cache_stat = None
+    if cache_stat is not None and (now - cache_stat.st_mtime) <= ttl:
+        _mem_cache_store(mem_key, target)
         return target
 
-    tmp_target = target.with_suffix(target.suffix + ".tmp")
+    conditional_headers: dict = {}
+    if cache_stat is not None:
+        try:
+            meta = json.loads(meta_path.read_text(encoding="utf-8"))
+            if meta.get("etag"):
+                conditional_headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                conditional_headers["If-Modified-Since"] = meta["last_modified"]
+        except Exception:
+            pass
+
+    # Her yazıcıya benzersiz tmp dosyası: aynı URL'yi aynı anda tazeleyen iki
+    # worker deterministik tek .tmp üstünde yarışamaz; hedefe geçiş os.replace
+    # ile atomiktir.
     try:
-        with urllib.request.urlopen(raw_url, timeout=15) as resp:
-            data = resp.read()
-        if not data:
-            return target if target.exists() else None
-        tmp_target.write_bytes(data)
-        tmp_target.replace(target)
-        return target
-    except Exception:
-        if tmp_target.exists():
+        tmp_fd, tmp_name = tempfile.mkstemp(
+            prefix=target.name + ".", suffix=".tmp", dir=str(target.parent)
+        )
+        os.close(tmp_fd)
+    except OSError:
+        return target if cache_stat is not None else None
+    tmp_target = Path(tmp_name)
+    try:
+        # Gövde tek bytes objesi olarak RAM'e alınmaz; 1MB'lık parçalarla
+        # doğrudan diske akıtılır (peak bellek dosya boyutundan bağımsız).
+        bytes_written, validators = _download_to(
+            raw_url, tmp_target, headers=conditional_headers or None
+        )
+        if bytes_written is None:
+            # 304: içerik değişmemiş, transfer yok; TTL penceresi mtime ile açılır.
+            try:
+                tmp_target.unlink()
+            except Exception:
+                pass
+            os.utime(target, None)
+            _mem_cache_store(mem_key, target)
+            return target
+        if not bytes_written:
             try:
                 tmp_target.unlink()
             except Exception:
                 pass
-        return target if target.exists() else None
+            return target if cache_stat is not None else None
+        tmp_target.replace(target)
+        try:
+            if validators.get("etag") or validators.get("last_modified"):
+                meta_path.write_text(json.dumps(validators), encoding="utf-8")
+            else:
+                meta_path.unlink(missing_ok=True)
+        except Exception:
+            pass
+        _mem_cache_store(mem_key, target)
+        return target
+    except Exception:
+        try:
+            tmp_target.unlink()
+        except Exception:
+            pass
+        return target if cache_stat is not None else None
+
+
+def cache_remote_files(
+    items: list[tuple[str, str]],
+    ttl_seconds: int = 900,
+    max_workers: int = 8,
+) -> list[Path | None]:
+    """
+    Birden çok (url, cache_name) çiftini thread havuzuyla paralel cacheler.
+    Ağ gecikmeleri worker'lar arasında örtüşür; dönen liste girdi sırasını korur.
+    """
+    if not items:
+        return []
+    if len(items) == 1:
+        url, cache_name = items[0]
+        return [cache_remote_file(url, cache_name, ttl_seconds=ttl_seconds)]
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    workers = max(1, min(int(max_workers), len(items)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(
+            executor.map(
+                lambda item: cache_remote_file(item[0], item[1], ttl_seconds=ttl_seconds),
+                items,
+            )
+        )
 
 
 def invalidate_remote_cache(url: str, cache_name: str) -> bool:
@@ -67,14 +265,23 @@ def invalidate_remote_cache(url: str, cache_name: str) -> bool:
     if not is_http_url(raw_url):
         return False
 
+    with _mem_cache_lock:
+        _mem_cache.pop((raw_url, str(cache_name or "")), None)
+
     target = _resolve_cache_target(raw_url, cache_name)
     deleted = False
-    for candidate in (target, target.with_suffix(target.suffix + ".tmp")):
-        if not candidate.exists():
-            continue
+    for candidate in (
+        target,
+        target.with_suffix(target.suffix + ".tmp"),
+        target.with_suffix(target.suffix + ".meta"),
+    ):
+        # exists() + unlink() yerine doğrudan unlink: yok olan dosya için tek
+        # syscall'da FileNotFoundError alınır.
         try:
             candidate.unlink()
             deleted = True
+        except FileNotFoundError:
+            continue
         except Exception:
             pass
     return deleted